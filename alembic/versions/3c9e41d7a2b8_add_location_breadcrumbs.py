@@ -0,0 +1,40 @@
+"""add location breadcrumbs
+
+Revision ID: 3c9e41d7a2b8
+Revises: f6383f14a121
+Create Date: 2026-10-18 12:04:11.520417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c9e41d7a2b8'
+down_revision: Union[str, Sequence[str], None] = 'f6383f14a121'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # daily partitions are created ahead of time by the app (services/breadcrumbs.py)
+    op.create_table('location_breadcrumbs',
+    sa.Column('breadcrumb_id', sa.BigInteger(), autoincrement=True, nullable=False),
+    sa.Column('recorded_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('request_id', sa.Integer(), nullable=False),
+    sa.Column('mechanic_lat', sa.Numeric(precision=9, scale=6), nullable=False),
+    sa.Column('mechanic_lng', sa.Numeric(precision=9, scale=6), nullable=False),
+    sa.ForeignKeyConstraint(['request_id'], ['service_requests.request_id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('breadcrumb_id', 'recorded_at'),
+    postgresql_partition_by='RANGE (recorded_at)'
+    )
+    op.create_index('ix_location_breadcrumbs_request_recorded', 'location_breadcrumbs', ['request_id', 'recorded_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_location_breadcrumbs_request_recorded', table_name='location_breadcrumbs')
+    op.drop_table('location_breadcrumbs')
@@ -5,6 +5,8 @@ from app.db.models import User, create_db_and_tables
 from contextlib import asynccontextmanager
 from core.auth import auth_backend , fastapi_users, get_user_manager
 from routes import admin , mechanics, tracking, users , requests , ratings
+from services.location_writer import location_writer
+from services.breadcrumbs import breadcrumbs
 from fastapi.middleware.cors import CORSMiddleware
 
 import os
@@ -14,7 +16,17 @@ from fastapi_users import BaseUserManager, FastAPIUsers
 import resend
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    location_writer.start()
+    breadcrumbs.start()
+    yield
+    # buffered live locations are written before the worker exits
+    await location_writer.stop()
+    await breadcrumbs.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 app.add_middleware(
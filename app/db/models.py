@@ -8,7 +8,9 @@ from fastapi_users.db import (
 )
 
 from sqlalchemy import (
+    BigInteger,
     Column,
+    Index,
     Integer,
     String,
     Text,
@@ -18,6 +20,7 @@ from sqlalchemy import (
     ForeignKey,
     Numeric,
     func,
+    text,
 )
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import DeclarativeBase, relationship
@@ -85,6 +88,8 @@ class User(SQLAlchemyBaseUserTableUUID, Base):
     avg_rating = Column(Float)
     is_available = Column(Boolean, server_default="false")
     review_count = Column(Integer)
+    # bit per SkillName (services/skill_mask.py), mirrors mechanic_skills
+    skill_mask = Column(Integer, nullable=False, default=0, server_default="0")
     # Relationships
     service_requests = relationship(
         "ServiceRequest",
@@ -121,6 +126,10 @@ class User(SQLAlchemyBaseUserTableUUID, Base):
 
 class ServiceRequest(Base):
     __tablename__ = "service_requests"
+    __table_args__ = (
+        # keyset pagination of the admin listing, see services/pagination.py
+        Index("ix_service_requests_created_request", "created_at", "request_id"),
+    )
 
     request_id = Column(Integer, primary_key=True, autoincrement=True)
 
@@ -175,6 +184,31 @@ class ServiceRequest(Base):
 
 
 
+# request histories, keyset paginated per user / mechanic. Partial on the
+# finished statuses so the sort keys follow the owner column directly and a
+# page is read in order; the included columns let it be answered from the
+# index alone. The predicate must stay identical to the history queries.
+HISTORY_STATUS_PREDICATE = text("status IN ('Completed', 'Canceled by User', 'Canceled by Mechanic')")
+
+Index(
+    "ix_service_requests_user_history",
+    ServiceRequest.user_id,
+    ServiceRequest.created_at.desc(),
+    ServiceRequest.request_id.desc(),
+    postgresql_include=["status", "mechanic_id", "request_type", "completed_at"],
+    postgresql_where=HISTORY_STATUS_PREDICATE,
+)
+Index(
+    "ix_service_requests_mechanic_history",
+    ServiceRequest.mechanic_id,
+    ServiceRequest.created_at.desc(),
+    ServiceRequest.request_id.desc(),
+    postgresql_include=["status", "user_id", "request_type", "completed_at"],
+    postgresql_where=HISTORY_STATUS_PREDICATE,
+)
+
+
+
 class LocationTracking(Base):
     __tablename__ = "location_tracking"
 
@@ -201,6 +235,60 @@ class LocationTracking(Base):
 
 
 
+class LocationBreadcrumb(Base):
+    __tablename__ = "location_breadcrumbs"
+    # append-only history of every stored live location, one partition per
+    # day (location_breadcrumbs_pYYYYMMDD) created and dropped by
+    # services/breadcrumbs.py
+    __table_args__ = (
+        Index("ix_location_breadcrumbs_request_recorded", "request_id", "recorded_at"),
+        {"postgresql_partition_by": "RANGE (recorded_at)"},
+    )
+
+    breadcrumb_id = Column(BigInteger, primary_key=True, autoincrement=True)
+
+    recorded_at = Column(
+        DateTime(timezone=True),
+        primary_key=True,
+        nullable=False,
+    )
+
+    request_id = Column(
+        Integer,
+        ForeignKey("service_requests.request_id", ondelete="CASCADE"),
+        nullable=False,
+    )
+
+    mechanic_lat = Column(Numeric(9, 6), nullable=False)
+    mechanic_lng = Column(Numeric(9, 6), nullable=False)
+
+
+
+class LocationTrackArchive(Base):
+    __tablename__ = "location_track_archives"
+    # the breadcrumbs of a completed request compacted into one row, see
+    # services/polyline.py for the encoding
+
+    request_id = Column(
+        Integer,
+        ForeignKey("service_requests.request_id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+
+    point_count = Column(Integer, nullable=False)
+    started_at = Column(DateTime(timezone=True), nullable=False)
+    # encoded polyline of the points, 6 decimals
+    polyline = Column(Text, nullable=False)
+    # milliseconds since started_at of every point, delta encoded
+    time_offsets = Column(Text, nullable=False)
+
+    created_at = Column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+    )
+
+
+
 class Rating(Base):
     __tablename__ = "ratings"
 
@@ -283,6 +371,11 @@ class MechanicSkill(Base):
     mechanic = relationship("User", back_populates="skills")
     skill = relationship("Skill", back_populates="mechanics")
 
+    __table_args__ = (
+        # the primary key leads with mechanic_id, skill lookups go the other way
+        Index("ix_mechanic_skills_skill_mechanic", "skill_id", "mechanic_id"),
+    )
+
 
 
 
@@ -132,6 +132,12 @@ class LocationTrackingRead(BaseModel):
     timestamp: Optional[datetime] = None
 
 
+class LocationFixCreate(BaseModel):
+    lat: float
+    lng: float
+    timestamp: datetime
+
+
 
 class RatingCreate(BaseModel):
     rating: int
@@ -84,3 +84,9 @@ async def require_mechanic_or_user(user: User = Depends(current_active_user)):
     return user
 
 
+
+
+async def require_any_role(user: User = Depends(current_active_user)):
+    if user.role not in ("admin" , "mechanic" , "user"):
+        raise HTTPException(status_code=403, detail="Access required")
+    return user
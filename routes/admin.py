@@ -1,11 +1,15 @@
 from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy import select
+from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.schemas import MechanicAdminUpdate, SkillCreate, UserUpdate
 from dependencies.helper import Status, swagger_responses
 from dependencies.permissions import require_admin
 from app.db.models import Rating, Skill, get_async_session , User , ServiceRequest 
 import uuid
+from services.fleet_map import fleet
+from services.nearby_mechanics import nearby
+from services.skill_mask import mask_skills, skill_bit
+from services.tracking_lifecycle import end_tracking
 
 router = APIRouter(
     prefix="/admin",
@@ -155,6 +159,11 @@ async def delete_request(
             raise HTTPException(status_code=404, detail="Request not found")
         await session.delete(request)
         await session.commit()
+        fleet.remove("request", request_id)
+        await end_tracking(request_id)
+        await nearby.close_request(request_id, reason="request deleted")
+        if request.mechanic_id is not None and request.status in (Status.accepted, Status.arrived):
+            await fleet.return_to_workshop(request.mechanic_id, session)
         return {"message": "Request deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -186,6 +195,7 @@ async def delete_account(
             raise HTTPException(status_code=404, detail="User not found")
         await session.delete(user)
         await session.commit()
+        fleet.remove("mechanic", id)
         return {"message": "Account deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -267,7 +277,19 @@ async def delete_skill(
         if not skill:
             raise HTTPException(status_code=404, detail="Skill not found")
         await session.delete(skill)
+        # the mechanic_skills rows go with the cascade, clear the bit with them
+        bit = skill_bit(skill.skill_name)
+        if bit:
+            await session.execute(
+                update(User)
+                .where(User.skill_mask.op("&")(bit) != 0)
+                .values(skill_mask=User.skill_mask.op("&")(~bit))
+            )
         await session.commit()
+        for entity in list(fleet.entities.values()):
+            if entity["kind"] == "mechanic" and (entity.get("skill_mask") or 0) & bit:
+                mask = entity["skill_mask"] & ~bit
+                fleet.update("mechanic", entity["id"], skills=mask_skills(mask), skill_mask=mask)
         return {"message": "Skill deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,16 +1,18 @@
 from datetime import datetime, timezone
 from decimal import Decimal
-from typing import Set
+from typing import List, Set
 from fastapi import APIRouter, HTTPException, Depends, Query
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from dependencies.helper import SkillName, Status, swagger_responses
 from dependencies.permissions import require_admin, require_mechanic
-from app.db.schemas import MechanicAdminUpdate, MechanicRead, MechanicSkillCreate, MechanicUpdate
+from app.db.schemas import LocationFixCreate, MechanicAdminUpdate, MechanicRead, MechanicSkillCreate, MechanicUpdate
 from app.db.models import LocationTracking, MechanicSkill, ServiceRequest, Skill, get_async_session , User 
 import uuid
-from services.webscoket_manager import manager
-from services.distance import haversine_distance
+from services.fleet_map import fleet
+from services.live_location import process_location_batch, process_location_fix, validate_fixes
+from services.skill_mask import mask_skills, skill_bit
+from services.tracking_sessions import tracking_sessions
 
 
 
@@ -164,6 +166,7 @@ async def update_workshop_location(
         mechanic.workshop_lng = lng       
         await session.commit()
         await session.refresh(mechanic)
+        fleet.update("mechanic", mechanic.id, lat, lng, name=mechanic.name)
         return {"message" : "Location updated successfully"}
     except Exception as e:
         raise HTTPException(status_code=500 , detail=str(e))
@@ -200,6 +203,11 @@ async def update_availabilty(
         mechanic.is_available = availability   
         await session.commit()
         await session.refresh(mechanic)
+        fleet.update(
+            "mechanic",
+            mechanic.id,
+            status="available" if availability else "unavailable",
+        )
         return {"message": "Availabilty updated"}
     except Exception as e:
         raise HTTPException(status_code=500 , detail=str(e))
@@ -248,7 +256,15 @@ async def set_skils(
                         skill_id = r_skill.skill_id
                     )
                     session.add(s_skill)
+                    # committed together with the mechanic_skills row
+                    cur_mechanic.skill_mask = (cur_mechanic.skill_mask or 0) | skill_bit(skill)
                     await session.commit()              
+            fleet.update(
+                "mechanic",
+                cur_mechanic.id,
+                skills=mask_skills(cur_mechanic.skill_mask),
+                skill_mask=cur_mechanic.skill_mask,
+            )
             return {"message" : "skills set successfully"}
         except Exception as e:
                 raise HTTPException(status_code=500 , detail= str(e))
@@ -301,24 +317,48 @@ Update the authenticated mechanic's live GPS location
 for their currently assigned service request.
 
 Location update rules:
-- Database is updated only if:
+- Fixes are smoothed per request; jumps faster than GPS_MAX_SPEED_KMH
+  are rejected as outliers ("rejected": true) and change nothing
+- The stored location is refreshed only if:
     • Mechanic moved ≥ 10 meters
     OR
     • 30 seconds passed since last update
-- If mechanic is within arrival range of request location:
+- Stored locations are buffered in memory and written to the
+  database in bulk every TRACKING_FLUSH_INTERVAL seconds, and
+  on status transitions
+- Arrival is detected by the request's geofence, held in memory:
+  a circle of GEOFENCE_RADIUS_M (25 m) around the request location,
+  left again only beyond the radius + GEOFENCE_HYSTERESIS_M.
+  With GEOFENCE_ARRIVAL_EVENT=dwell the mechanic must stay inside
+  GEOFENCE_DWELL_S seconds. On arrival:
     • Request status is automatically updated to ARRIVED
     • WebSocket tracking is closed
+- Location broadcasts are coalesced: watchers receive only the newest
+  position, at most TRACKING_BROADCAST_MAX_HZ times per second.
+  The arrival event is sent immediately.
 
 Used for:
 - Real-time tracking
 - Automatic arrival detection
 
+For continuous streaming prefer the WebSocket
+/ws/mechanic/live_location/{request_id}, which authenticates once
+per connection instead of once per fix.
+
+Sampling hints (while the mechanic hasn't arrived):
+- next_update_in_ms → when the client should send its next fix
+- min_distance_m → fixes closer than this to the last sent one can be skipped
+Both are sparse far from the destination and dense near the
+arrival range, clients should follow them to save battery and traffic.
+
 🔒 Mechanic authentication required
     """,
     responses=swagger_responses(
         success_message={
-            "message": "Location processed",
-            "arrived": False
+            "message": "Location updated",
+            "arrived": False,
+            "next_update_in_ms": 15000,
+            "min_distance_m": 120
         },
         access_role="Mechanic"
     ),
@@ -331,98 +371,109 @@ async def update_mechanic_location(
     cur_mechanic: User = Depends(require_mechanic)
 ):
 
-    result = await db.execute(
-        select(ServiceRequest).where(
-            ServiceRequest.request_id == request_id
-        )
-    )
-    request = result.scalar_one_or_none()
+    # served from the per-worker session cache, the DB is only read on a miss
+    state = await tracking_sessions.get_or_load(request_id, db)
 
-    if not request or request.mechanic_id != cur_mechanic.id:
+    if not state or state.mechanic_id != cur_mechanic.id:
         raise HTTPException(status_code=404, detail="Request not found")
 
-    if request.status != Status.accepted:
+    if state.status != Status.accepted:
         raise HTTPException(status_code=400, detail="Tracking not active")
 
+    result = await process_location_fix(state, lat, lng, db)
 
-    result = await db.execute(
-        select(LocationTracking).where(
-            LocationTracking.request_id == request_id
-        )
-    )
-    tracking = result.scalar_one_or_none()
+    return {"message": "Location updated" , **result}
 
-    if not tracking:
-        raise HTTPException(status_code=404, detail="Tracking row not found")
 
-    distance = haversine_distance(
-        tracking.mechanic_lat,
-        tracking.mechanic_lng,
-        lat,
-        lng
-    )
 
-    time_passed = (datetime.now(timezone.utc) - tracking.timestamp).total_seconds()
 
-    if distance >= 10 or time_passed >= 30:
-        tracking.mechanic_lat = lat
-        tracking.mechanic_lng = lng
-        tracking.timestamp = datetime.now(timezone.utc)
 
-        await db.commit()
-        await db.refresh(tracking)
 
-    arrival_distance = haversine_distance(
-        request.user_lat,
-        request.user_lng,
-        lat,
-        lng,
-        km = False
-    )
+@router.post(
+    "/mechanic/live_location/{request_id}/batch",
+    status_code=200,
+    summary="Upload buffered mechanic locations",
+    description="""
+Upload the GPS fixes the mechanic's app recorded while it was offline,
+for their currently assigned service request.
 
-    arrived = False
-
-    if arrival_distance <= 25:
-        request.status = Status.arrived
-        await db.commit()
-        arrived = True
-
-    await manager.broadcast(
-        request_id,
-        {
-            "request_id": request_id,
-            "lat": lat,
-            "lng": lng,
-            "arrived" : arrived ,
-            "timestamp": datetime.now().isoformat()  
-        }
-    )
-    if arrived:
-        connections = manager.active_connections.get(request_id, [])
-        if request_id in connections:
-            for connection in manager.active_connections[request_id]:
-                await connection.close()
-                
-        manager.active_connections.pop(request_id, None)
-    
-    return {"message": "Location updated" , "arrived" : arrived}
+Request body: ordered array of fixes
+[{"lat": 30.1234, "lng": 31.5678, "timestamp": "ISO_DATETIME"}, ...]
+
+Rules:
+- Timestamps must be strictly increasing and not in the future,
+  at most TRACKING_MAX_BATCH_FIXES fixes per batch
+- Fixes older than the last stored location are ignored
+- Fixes are smoothed and outliers rejected like on the live endpoint
+- The same storage rules as the live endpoint are applied over the
+  sequence (≥ 10 meters moved OR 30 seconds passed), the stored points
+  are written at once
+- Arrival is detected on the first fix triggering the geofence, later
+  fixes are ignored
+- Only the final position is broadcast to the tracking WebSocket
+- The response counts the fixes used ("accepted"), rejected as
+  outliers ("rejected") and ignored as stale or after the arrival
+  ("skipped")
+
+🔒 Mechanic authentication required
+    """,
+    responses=swagger_responses(
+        success_message={
+            "message": "Locations uploaded",
+            "arrived": False,
+            "accepted": 120,
+            "stored": 34,
+            "rejected": 2,
+            "skipped": 0,
+            "next_update_in_ms": 15000,
+            "min_distance_m": 120
+        },
+        access_role="Mechanic",
+        validation=True,
+        not_found=True,
+        bad_request_message="Fix 3: timestamps must be strictly increasing"
+    ),
+)
+async def upload_mechanic_locations(
+    request_id: int,
+    fixes: List[LocationFixCreate],
+    db: AsyncSession = Depends(get_async_session),
+    cur_mechanic: User = Depends(require_mechanic)
+):
+
+    points = [
+        (
+            fix.lat,
+            fix.lng,
+            fix.timestamp if fix.timestamp.tzinfo else fix.timestamp.replace(tzinfo=timezone.utc),
+        )
+        for fix in fixes
+    ]
+    error = validate_fixes(points)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
 
+    state = await tracking_sessions.get_or_load(request_id, db)
 
+    if not state or state.mechanic_id != cur_mechanic.id:
+        raise HTTPException(status_code=404, detail="Request not found")
 
+    if state.status != Status.accepted:
+        raise HTTPException(status_code=400, detail="Tracking not active")
 
+    result = await process_location_batch(state, points, db)
+
+    return {"message": "Locations uploaded" , **result}
 
-async def get_mechanic_skills(mechanic_id, session):
-    result = await session.execute(select(MechanicSkill).where(MechanicSkill.mechanic_id == mechanic_id))
-    skills_id = [row[0] for row in result.all()]
-    skill_id_list = []
-
-    for skill in skills_id:
-        skill_id_list.append(skill.skill_id)
-    
-    skills = []
-    for id in skill_id_list:
-        result = await session.execute(select(Skill).where(Skill.skill_id == id))
-        skill1 = result.scalar_one_or_none()
-        skills.append(skill1.skill_name)
-    return skills
 
+
+
+
+async def get_mechanic_skills(mechanic_id, session):
+    # one join instead of a lookup per skill id
+    result = await session.execute(
+        select(Skill.skill_name)
+        .join(MechanicSkill, MechanicSkill.skill_id == Skill.skill_id)
+        .where(MechanicSkill.mechanic_id == mechanic_id)
+    )
+    return list(result.scalars().all())
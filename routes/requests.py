@@ -1,16 +1,27 @@
 from fastapi import APIRouter, HTTPException, Depends, Query
-from sqlalchemy import select
+from sqlalchemy import exists, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.schemas import SkillName
 from dependencies.helper import Status, swagger_responses
 from dependencies.permissions import require_admin, require_mechanic, require_user
 from app.db.models import  LocationTracking, MechanicSkill, Skill, get_async_session , User ,  ServiceRequest 
 from datetime import datetime, timezone
+from typing import Optional
+from sqlalchemy.orm import aliased
 
 
-from routes.mechanics import get_mechanic_skills
 from services.distance import calculate_score
 from services.weights import get_weights
+from services.fleet_map import fleet
+from services.location_writer import location_writer
+from services.geofence import geofences
+from services.nearby_mechanics import nearby
+from services.notifications import notifications
+from services.tracking_lifecycle import end_tracking
+from services.tracking_sessions import TrackingState, tracking_sessions
+from services.breadcrumbs import breadcrumbs
+from services.skill_mask import mask_skills
+from services.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, after_cursor, next_cursor, valid_cursor
 
 
 
@@ -27,13 +38,18 @@ router = APIRouter(
     status_code=200,
     summary="Get all service requests",
     description="""
-Retrieve all service requests in the system.
+Retrieve all service requests in the system, newest first, one page at a time.
 
 Includes:
 - User and mechanic information
 - Request status and type
 - Creation and completion timestamps
 
+Pagination:
+- limit → page size (default 50, max 200)
+- cursor → "next cursor" of the previous page; omit for the first page
+- "next cursor" is null on the last page
+
 🔒 Authentication required  
 🛡 Admin access required
     """,
@@ -51,55 +67,75 @@ Includes:
                     "created at": "2024-01-01T10:00:00",
                     "completed_at": "2024-01-01T11:00:00",
                 }
-            ]
+            ],
+            "next cursor": "MjAyNC0wMS0wMVQxMDowMDowMHwx",
         },
         access_role="Admin",
+        bad_request_message="invalid cursor",
     ),
 )
 async def get_all_requests(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
     admin = Depends(require_admin),
     session : AsyncSession = Depends(get_async_session)
 ):
+    if cursor is not None and not valid_cursor(cursor):
+        raise HTTPException(status_code=400, detail="invalid cursor")
+
     try:
-        result = await session.execute(
-            select(ServiceRequest).order_by(ServiceRequest.created_at.desc())
+        customer = aliased(User)
+        mechanic = aliased(User)
+        stmt = (
+            select(
+                ServiceRequest.request_id,
+                ServiceRequest.user_id,
+                customer.name,
+                ServiceRequest.mechanic_id,
+                mechanic.name,
+                ServiceRequest.status,
+                ServiceRequest.request_type,
+                ServiceRequest.created_at,
+                ServiceRequest.completed_at,
+            )
+            .join(customer, customer.id == ServiceRequest.user_id)
+            .outerjoin(mechanic, mechanic.id == ServiceRequest.mechanic_id)
+            .limit(limit + 1)
         )
-        requests = result.scalars().all()
-        requests_list = []
+        stmt = after_cursor(stmt, ServiceRequest.created_at, ServiceRequest.request_id, cursor)
 
-        for request in requests:
-            result1 = await session.execute(select(User).where(User.id == request.user_id))
-            user = result1.scalar_one_or_none()
-
-            result2 = await session.execute(select(User).where(User.id == request.mechanic_id))
-            mechanic = result2.scalar_one_or_none()
-
-            if not mechanic:
-                mechanic_id = "----"
-                mechanic_name = "----"
-            else:
-                mechanic_id = mechanic.id
-                mechanic_name = mechanic.name
-
-            if request.status != "Completed":
-                completed_at = "----"
-            else:
-                completed_at = request.completed_at
+        result = await session.execute(stmt)
+        rows = result.all()
+        requests_list = []
 
+        for (
+            request_id,
+            user_id,
+            user_name,
+            mechanic_id,
+            mechanic_name,
+            status,
+            request_type,
+            created_at,
+            completed_at,
+        ) in rows[:limit]:
             requests_list.append(
                 {
-                    "id": request.request_id,
-                    "user id": request.user_id,
-                    "user name": user.name,
-                    "mechanic id": mechanic_id,
-                    "mechanic name": mechanic_name,
-                    "status": request.status,
-                    "type": request.request_type,
-                    "created at": request.created_at,
-                    "completed_at": completed_at,
+                    "id": request_id,
+                    "user id": user_id,
+                    "user name": user_name,
+                    "mechanic id": mechanic_id if mechanic_id else "----",
+                    "mechanic name": mechanic_name if mechanic_id else "----",
+                    "status": status,
+                    "type": request_type,
+                    "created at": created_at,
+                    "completed_at": completed_at if status == "Completed" else "----",
                 }
             )
-        return {"requests": requests_list}
+        return {
+            "requests": requests_list,
+            "next cursor": next_cursor(rows, limit, lambda row: row.created_at, lambda row: row.request_id),
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -108,6 +144,7 @@ async def get_all_requests(
 
 
 
+
 @router.post(
     "/user/create",
     status_code=200,
@@ -162,6 +199,15 @@ async def create_request(
         await session.commit()
         await session.refresh(request)
 
+        fleet.update(
+            "request",
+            request.request_id,
+            request.user_lat,
+            request.user_lng,
+            status=request.status,
+            type=request.request_type,
+        )
+
         return {"message": "your request status is Pending"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -275,6 +321,7 @@ async def user_cancel_request(
             )
 
         if request.status == Status.accepted:
+            await location_writer.flush(request.request_id, session=session)
             request.status = Status.canceled_user
             await session.commit()
             await session.refresh(request)
@@ -282,10 +329,22 @@ async def user_cancel_request(
             cur_user.canceled_count += 1
             await session.commit()
             await session.refresh(cur_user)
+
+            breadcrumbs.finish_track(request.request_id)
         else:
             await session.delete(request)
             await session.commit()
 
+        await nearby.close_request(request.request_id, reason="request canceled")
+        event = {"request_id": request.request_id, "status": Status.canceled_user}
+        await end_tracking(request.request_id, event=event, upstream_message={"type": "status", **event})
+        await notifications.notify_status(
+            request.request_id, Status.canceled_user, request.user_id, request.mechanic_id
+        )
+        fleet.remove("request", request.request_id)
+        if request.mechanic_id is not None:
+            await fleet.return_to_workshop(request.mechanic_id, session)
+
         return {"message": "the request canceled successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -299,13 +358,19 @@ async def user_cancel_request(
     status_code=200,
     summary="Get user old requests",
     description="""
-Retrieve completed or canceled service requests for the authenticated user.
+Retrieve completed or canceled service requests for the authenticated user,
+newest first, one page at a time.
 
 Includes:
 - Mechanic information
 - Request status
 - Creation and completion timestamps
 
+Pagination:
+- limit → page size (default 50, max 200)
+- cursor → "next cursor" of the previous page; omit for the first page
+- "next cursor" is null on the last page
+
 🔒 User authentication required
     """,
     responses=swagger_responses(
@@ -320,64 +385,74 @@ Includes:
                     "created at": "2024-01-01T10:00:00",
                     "completed at": "2024-01-01T11:00:00",
                 }
-            ]
+            ],
+            "next cursor": "MjAyNC0wMS0wMVQxMDowMDowMHwx",
         },
         access_role="User",
+        bad_request_message="invalid cursor",
     ),
 )
 async def get_user_old_requests(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
     cur_user : User = Depends(require_user),
     session : AsyncSession = Depends(get_async_session)
 ):
+    if cursor is not None and not valid_cursor(cursor):
+        raise HTTPException(status_code=400, detail="invalid cursor")
+
     try:
-        result = await session.execute(
-            select(ServiceRequest)
-            .order_by(ServiceRequest.created_at.desc())
+        stmt = (
+            select(
+                ServiceRequest.request_id,
+                ServiceRequest.mechanic_id,
+                User.name,
+                ServiceRequest.status,
+                ServiceRequest.request_type,
+                ServiceRequest.created_at,
+                ServiceRequest.completed_at,
+            )
+            .outerjoin(User, User.id == ServiceRequest.mechanic_id)
             .where(
                 ServiceRequest.user_id == cur_user.id,
                 ServiceRequest.status.in_(
                     (Status.completed, Status.canceled_user, Status.canceled_mechanic)
                 )
             )
+            .limit(limit + 1)
         )
-        requests = result.scalars().all()
-        requests_list = []
+        stmt = after_cursor(stmt, ServiceRequest.created_at, ServiceRequest.request_id, cursor)
 
-        for request in requests:
-            result2 = await session.execute(
-                select(User).where(User.id == request.mechanic_id)
-            )
-            mechanic = result2.scalar_one_or_none()
+        result = await session.execute(stmt)
+        rows = result.all()
+        requests_list = []
 
-            if not mechanic:
+        for request_id, mechanic_id, mechanic_name, status, request_type, created_at, completed_at in rows[:limit]:
+            if not mechanic_id:
                 mechanic_id = "----"
                 mechanic_name = "----"
-            else:
-                mechanic_id = mechanic.id
-                mechanic_name = mechanic.name
 
-            if request.status != Status.completed:
+            if status != Status.completed:
                 completed_at = "----"
-            else:
-                completed_at = request.completed_at
 
-            if request.status == Status.canceled_user:
+            if status == Status.canceled_user:
                 status = "Canceled by You"
-            else:
-                status = request.status
 
             requests_list.append(
                 {
-                    "request id": request.request_id,
+                    "request id": request_id,
                     "mechanic id": mechanic_id,
                     "mechanic name": mechanic_name,
                     "status": status,
-                    "type": request.request_type,
-                    "created at": request.created_at,
+                    "type": request_type,
+                    "created at": created_at,
                     "completed at": completed_at,
                 }
             )
-        return {"requests": requests_list}
+        return {
+            "requests": requests_list,
+            "next cursor": next_cursor(rows, limit, lambda row: row.created_at, lambda row: row.request_id),
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -386,6 +461,7 @@ async def get_user_old_requests(
 
 
 
+
 @router.get(
     "/available_requests",
     status_code=200,
@@ -428,26 +504,27 @@ async def get_all_available_request_for_mechanic(
             raise HTTPException(status_code=400, detail="update your availabilty first")
 
         weights = await get_weights(session)
+        # skills come from the mechanic's skill mask and are matched in SQL,
+        # the customer comes from the same query
+        skills = mask_skills(cur_mechanic.skill_mask)
+        if not skills:
+            return {"requests": []}
+
         result = await session.execute(
-            select(ServiceRequest).where(ServiceRequest.status == Status.pending)
+            select(ServiceRequest, User.name, User.user_lat, User.user_lng)
+            .join(User, User.id == ServiceRequest.user_id)
+            .where(
+                ServiceRequest.status == Status.pending,
+                ServiceRequest.request_type.in_(skills),
+            )
         )
 
         requests_list = []
 
-        for request in result.scalars().all():
-            if request.request_type not in await get_mechanic_skills(
-                cur_mechanic.id, session
-            ):
-                continue
-
-            result1 = await session.execute(
-                select(User).where(User.id == request.user_id)
-            )
-            user = result1.scalar_one_or_none()
-
+        for request, user_name, user_lat, user_lng in result.all():
             score = calculate_score(
-                user_lat=user.user_lat,
-                user_lng=user.user_lng,
+                user_lat=user_lat,
+                user_lng=user_lng,
                 mechanic_lat=cur_mechanic.workshop_lat,
                 mechanic_lng=cur_mechanic.workshop_lng,
                 mechanic_rating=cur_mechanic.avg_rating,
@@ -458,7 +535,7 @@ async def get_all_available_request_for_mechanic(
             requests_list.append(
                 {
                     "request id": request.request_id,
-                    "user name": user.name,
+                    "user name": user_name,
                     "type": request.request_type,
                     "request lat": request.user_lat,
                     "request lng": request.user_lng,
@@ -532,27 +609,23 @@ async def get_all_available_mechanic_for_user(
             raise HTTPException(status_code=400, detail="set your location first")
 
         weights = await get_weights(session)
+        # skill, availability and workshop location all checked in one query
         result = await session.execute(
-            select(User).where(User.role == "mechanic", User.is_available == True)
+            select(User)
+            .join(MechanicSkill, MechanicSkill.mechanic_id == User.id)
+            .join(Skill, Skill.skill_id == MechanicSkill.skill_id)
+            .where(
+                Skill.skill_name == type.value,
+                User.role == "mechanic",
+                User.is_available == True,
+                User.workshop_lat.isnot(None),
+                User.workshop_lng.isnot(None),
+            )
         )
 
         mechanics_list = []
 
         for mechanic in result.scalars().all():
-            if not mechanic.workshop_lat or not mechanic.workshop_lng:
-                continue
-
-            result1 = await session.execute(
-                select(MechanicSkill)
-                .join(Skill, Skill.skill_id == MechanicSkill.skill_id)
-                .where(
-                    MechanicSkill.mechanic_id == mechanic.id,
-                    Skill.skill_name == type.value,
-                )
-            )
-            if not result1.scalar_one_or_none():
-                continue
-
             score = calculate_score(
                 user_lat=cur_user.user_lat,
                 user_lng=cur_user.user_lng,
@@ -664,6 +737,9 @@ This endpoint returns the mechanic's request history, including:
 📌 **Notes for frontend**
 - If the request was not completed, `completed at` will be `"----"`
 - If the mechanic canceled the request, status will be `"Canceled by You"`
+- Results are paged newest first: pass `limit` (default 50, max 200) and
+  the `"next cursor"` of the previous page as `cursor`; it is `null` on
+  the last page
 
 🔒 **Authentication required**  
 🧰 **Mechanic access only**
@@ -689,19 +765,35 @@ This endpoint returns the mechanic's request history, including:
                     "created at": "2024-01-03T11:00:00",
                     "completed at": "----"
                 }
-            ]
+            ],
+            "next cursor": "MjAyNC0wMS0wM1QxMTowMDowMHw0MQ=="
         },
         access_role="Mechanic",
         not_found=False,
+        bad_request_message="invalid cursor",
     ),
 )
 async def get_mechanic_old_requests(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
     cur_mechanic: User = Depends(require_mechanic),
     session: AsyncSession = Depends(get_async_session),
 ):
+    if cursor is not None and not valid_cursor(cursor):
+        raise HTTPException(status_code=400, detail="invalid cursor")
+
     try:
-        result = await session.execute(
-            select(ServiceRequest)
+        stmt = (
+            select(
+                ServiceRequest.request_id,
+                ServiceRequest.user_id,
+                User.name,
+                ServiceRequest.status,
+                ServiceRequest.request_type,
+                ServiceRequest.created_at,
+                ServiceRequest.completed_at,
+            )
+            .join(User, User.id == ServiceRequest.user_id)
             .where(
                 ServiceRequest.mechanic_id == cur_mechanic.id,
                 ServiceRequest.status.in_(
@@ -712,41 +804,37 @@ async def get_mechanic_old_requests(
                     )
                 ),
             )
-            .order_by(ServiceRequest.created_at.desc())
+            .limit(limit + 1)
         )
+        stmt = after_cursor(stmt, ServiceRequest.created_at, ServiceRequest.request_id, cursor)
 
-        requests = result.scalars().all()
+        result = await session.execute(stmt)
+        rows = result.all()
         requests_list = []
 
-        for request in requests:
-            result = await session.execute(
-                select(User).where(User.id == request.user_id)
-            )
-            user = result.scalar_one_or_none()
-
-            if request.status != Status.completed:
+        for request_id, user_id, user_name, status, request_type, created_at, completed_at in rows[:limit]:
+            if status != Status.completed:
                 completed_at = "----"
-            else:
-                completed_at = request.completed_at
 
-            if request.status == Status.canceled_mechanic:
+            if status == Status.canceled_mechanic:
                 status = "Canceled by You"
-            else:
-                status = request.status
 
             requests_list.append(
                 {
-                    "request id": request.request_id,
-                    "user id": user.id,
-                    "user name": user.name,
+                    "request id": request_id,
+                    "user id": user_id,
+                    "user name": user_name,
                     "status": status,
-                    "type": request.request_type,
-                    "created at": request.created_at,
+                    "type": request_type,
+                    "created at": created_at,
                     "completed at": completed_at,
                 }
             )
 
-        return {"requests": requests_list}
+        return {
+            "requests": requests_list,
+            "next cursor": next_cursor(rows, limit, lambda row: row.created_at, lambda row: row.request_id),
+        }
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -790,6 +878,7 @@ async def mechanic_cancel_request(
                 detail="you have no assigned requests to cancel",
             )
 
+        await location_writer.flush(request.request_id, session=session)
         request.status = Status.canceled_mechanic
         await session.commit()
         await session.refresh(request)
@@ -798,6 +887,16 @@ async def mechanic_cancel_request(
         await session.commit()
         await session.refresh(cur_mechanic)
 
+        breadcrumbs.finish_track(request.request_id)
+
+        event = {"request_id": request.request_id, "status": Status.canceled_mechanic}
+        await end_tracking(request.request_id, event=event, upstream_message={"type": "status", **event})
+        await notifications.notify_status(
+            request.request_id, Status.canceled_mechanic, request.user_id, request.mechanic_id
+        )
+        fleet.remove("request", request.request_id)
+        fleet.update("mechanic", cur_mechanic.id, cur_mechanic.workshop_lat, cur_mechanic.workshop_lng)
+
         return {"message": "the request canceled succefully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -846,6 +945,7 @@ async def mechanic_complete_request(
                 detail="you have no assigned request to complete",
             )
 
+        await location_writer.flush(request.request_id, session=session)
         request.status = Status.completed
         request.completed_at = datetime.now()
         await session.commit()
@@ -855,6 +955,16 @@ async def mechanic_complete_request(
         await session.commit()
         await session.refresh(cur_mechanic)
 
+        breadcrumbs.finish_track(request.request_id, archive=True)
+
+        event = {"request_id": request.request_id, "status": Status.completed}
+        await end_tracking(request.request_id, event=event, upstream_message={"type": "status", **event})
+        await notifications.notify_status(
+            request.request_id, Status.completed, request.user_id, request.mechanic_id
+        )
+        fleet.remove("request", request.request_id)
+        fleet.update("mechanic", cur_mechanic.id, cur_mechanic.workshop_lat, cur_mechanic.workshop_lng)
+
         return {"message": "the request completed successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -872,6 +982,9 @@ async def mechanic_complete_request(
 Accept a pending service request as a mechanic.
 
 📌 A mechanic can only accept **one request at a time**.
+📌 The workshop location must be set first.
+📌 When several mechanics accept the same request at once,
+   exactly one succeeds; the others get "the request no longer available".
 
 🔒 Mechanic authentication required
     """,
@@ -887,37 +1000,57 @@ async def mechanic_accept_request(
     cur_mechanic : User = Depends(require_mechanic),
     session : AsyncSession = Depends(get_async_session),
 ):
+    # the tracking row starts at the workshop, checked before anything is claimed
+    if cur_mechanic.workshop_lat is None or cur_mechanic.workshop_lng is None:
+        raise HTTPException(status_code=400, detail="set your workshop location first")
+
     try:
-        result1 = await session.execute(
-            select(ServiceRequest).where(
-                ServiceRequest.mechanic_id == cur_mechanic.id,
-                ServiceRequest.status == Status.accepted,
-            )
+        # Accepts of one mechanic are serialized on their users row, held
+        # until the commit, so the active-job check below sees an accept of
+        # another request that committed meanwhile.
+        await session.execute(
+            select(User.id).where(User.id == cur_mechanic.id).with_for_update()
         )
-        if result1.scalar_one_or_none():
-            raise HTTPException(
-                status_code=400,
-                detail="you can't assign for more than request",
-            )
 
-        result2 = await session.execute(
-            select(ServiceRequest).where(
-                ServiceRequest.request_id == request_id
+        # One conditional UPDATE claims the request: it only matches while the
+        # request is still Pending and the mechanic has no active job, so of
+        # concurrent accepts exactly one gets a row back.
+        assigned = aliased(ServiceRequest)
+        result = await session.execute(
+            update(ServiceRequest)
+            .where(
+                ServiceRequest.request_id == request_id,
+                ServiceRequest.status == Status.pending,
+                ~exists().where(
+                    assigned.mechanic_id == cur_mechanic.id,
+                    assigned.status.in_([Status.accepted, Status.arrived]),
+                ),
             )
+            .values(status=Status.accepted, mechanic_id=cur_mechanic.id)
+            .returning(ServiceRequest)
         )
-        request = result2.scalar_one_or_none()
+        request = result.scalar_one_or_none()
 
-        if not request or request.status != Status.pending:
+        if not request:
+            # only a failed accept pays for telling the two cases apart
+            result1 = await session.execute(
+                select(ServiceRequest.request_id).where(
+                    ServiceRequest.mechanic_id == cur_mechanic.id,
+                    ServiceRequest.status.in_([Status.accepted, Status.arrived]),
+                ).limit(1)
+            )
+            if result1.scalar_one_or_none():
+                raise HTTPException(
+                    status_code=400,
+                    detail="you can't assign for more than request",
+                )
             raise HTTPException(
                 status_code=404,
                 detail="the request no longer available",
             )
 
-        request.status = Status.accepted
-        request.mechanic_id = cur_mechanic.id
-        await session.commit()
-        await session.refresh(request)
-
+        # the tracking row is part of the same transaction, an accepted
+        # request always has one
         tracking = LocationTracking(
             request_id = request.request_id,
             mechanic_lat = cur_mechanic.workshop_lat,
@@ -926,7 +1059,15 @@ async def mechanic_accept_request(
         )
         session.add(tracking)
         await session.commit()
-        await session.refresh(tracking)
+
+        fleet.update("request", request.request_id, status=request.status)
+        await nearby.close_request(request.request_id, reason="request accepted")
+
+        tracking_sessions.put(TrackingState.from_rows(request, tracking))
+        geofences.register(request.request_id, float(request.user_lat), float(request.user_lng))
+        await notifications.notify_status(
+            request.request_id, Status.accepted, request.user_id, request.mechanic_id
+        )
 
         return {"message": "the request accepted succefully"}
     except Exception as e:
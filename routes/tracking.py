@@ -1,12 +1,26 @@
-import asyncio
-
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect , WebSocketException
 from sqlalchemy import select
 from app.db.models import ServiceRequest, User, get_async_session
-from dependencies.helper import Status
-from dependencies.permissions import require_user, require_user_ws
+from dependencies.helper import Status, swagger_responses
+from dependencies.permissions import require_admin, require_any_role, require_user, require_user_ws
 from services.webscoket_manager import manager
+from services.tracking_frames import negotiate_subprotocol
+from services.location_cache import positions
+from services.fleet_map import fleet
+from services.live_location import stream_location_fixes
+from services.tracking_sessions import tracking_sessions
+from services.breadcrumbs import breadcrumbs
+from services.location_writer import location_writer
+from services.gps_filter import gps_filter
+from services.geofence import geofences
+from services.tracking_lifecycle import tracking_gauges
+from services.notifications import notifications
+from services.nearby_mechanics import NearbyWatcher, clamp_radius, nearby
+from services.mechanic_candidates import candidates
+from services.track_replay import stream_track
 from sqlalchemy.ext.asyncio import AsyncSession
 
 
@@ -29,13 +43,40 @@ async def websocket_tracking(websocket: WebSocket, request_id: int , cur_user :
             "lat": 30.1234,
             "lng": 31.5678,
             "arrived": false,
+            "eta_seconds": 420,
+            "remaining_km": 3.1,
             "timestamp": "ISO_DATETIME"
         }
+      eta_seconds and remaining_km are estimated from the mechanic's recent
+      speed and the straight-line distance to the request location
+      frames caused by a geofence transition carry "geofence": ["enter"],
+      with "enter", "exit" or "dwell" events
+
+    On connect the last known mechanic position is sent right away
+    with "snapshot": true, before any live update.
+
+    Frame format (chosen with Sec-WebSocket-Protocol at handshake):
+    - "tracking.json.v1" or no subprotocol → JSON text frames (default)
+    - "tracking.bin.v1" → 14-byte little-endian binary location frames
+        u8 version, u8 flags, i32 lat (microdegrees), i32 lng (microdegrees),
+        u32 seconds since 2024-01-01T00:00:00Z
+        flags: bit 0 arrived, bit 1 status present, bits 2-4 status code,
+        bit 5 ETA present → followed by u32 eta seconds, u32 remaining meters
+      Control messages (ping/pong) are always JSON text frames.
 
     Connection Rules:
     - Only the owner of the request can connect
     - Request must be in ACCEPTED status
-    - Connection automatically closes when mechanic arrives
+    - Connection closes (1000) when the mechanic arrives, or the request
+      is canceled, completed or deleted; a final
+      {"request_id": 1, "status": "..."} event is sent before the close
+
+    Heartbeat:
+    - The server sends {"type": "ping"} after a quiet period, clients
+      don't have to answer it; listen-only clients stay connected
+    - Clients may send {"type": "ping"} and receive {"type": "pong"}
+    - Sockets that can't take the server ping any more are closed (1001)
+    - When the connection cap is reached the stalest socket is closed (1013)
 
     🔒 User authentication required (Bearer token in headers)
     """
@@ -50,10 +91,348 @@ async def websocket_tracking(websocket: WebSocket, request_id: int , cur_user :
         await websocket.close(code=1008)
         return
       
-    await manager.connect(request_id, websocket)
+    # served from memory, the DB is only read once per request on a cache miss
+    snapshot = await positions.get_or_load(request_id, session)
+
+    # the socket can stay open for the whole job, don't hold a DB connection for it
+    await session.close()
+
+    subprotocol = negotiate_subprotocol(websocket.scope.get("subprotocols", []))
+    await manager.connect(request_id, websocket, subprotocol=subprotocol)
+    if snapshot:
+        await manager.send_to(websocket, {**snapshot, "snapshot": True})
+    await manager.listen(request_id, websocket)
+
+
+
+
+
+
+@router.websocket("/ws/mechanic/live_location/{request_id}")
+async def websocket_mechanic_location(websocket: WebSocket, request_id: int , cur_mechanic : User = Depends(require_user_ws) , session : AsyncSession = Depends(get_async_session)):
+
+    """
+    Mechanic upstream location WebSocket endpoint.
+
+    Stays open for the whole job and accepts a stream of GPS fixes for
+    the mechanic's assigned request. Authentication and request lookup
+    happen once per connection, each fix is then processed in memory with
+    the same storage, arrival and broadcast rules as
+    PATCH /mechanics/mechanic/live_location/{request_id}.
+
+    Client messages:
+    - {"lat": 30.1234, "lng": 31.5678} → one location fix
+    - {"type": "ping"}
+
+    Server messages:
+    - {"type": "arrived", "request_id": 1} → arrival detected, the socket
+      is then closed with code 1000
+    - {"type": "status", "request_id": 1, "status": "..."} → request canceled
+      or completed, the socket is then closed with code 1000
+    - {"type": "error", "detail": "..."} → malformed fix, stream continues
+    - {"type": "hint", "arrived": false, "next_update_in_ms": 15000,
+      "min_distance_m": 120} → sampling hints, sent when they change
+    - {"type": "ping"} / {"type": "pong"}
+
+    Connection Rules:
+    - Only the mechanic assigned to the request can connect
+    - Request must be in ACCEPTED status
+
+    🔒 Mechanic authentication required (Bearer token in headers)
+    """
+
+    if cur_mechanic.role != "mechanic":
+        await websocket.close(code=1008)
+        return
+
+    state = await tracking_sessions.get_or_load(request_id, session)
+    await session.close()
+
+    if not state or state.mechanic_id != cur_mechanic.id:
+        await websocket.close(code=1008)
+        return
+
+    if state.status != Status.accepted:
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    await stream_location_fixes(websocket, state)
+
+
+
+
+
+
+@router.websocket("/ws/notifications")
+async def websocket_notifications(websocket: WebSocket, cur_user : User = Depends(require_user_ws) , session : AsyncSession = Depends(get_async_session)):
+
+    """
+    Notification WebSocket endpoint.
+
+    One connection per signed-in user or mechanic, carrying the status
+    events of all their requests instead of polling
+    GET /requests/user/request and GET /requests/mechanic.
+
+    Server messages:
+    - {"type": "status", "request_id": 1, "status": "Accepted"} → sent on
+      accept, arrival, cancellation (either side) and completion
+    - {"type": "tracking", "request_id": 1, "data": {...}} → a frame of a
+      subscribed tracking channel, same JSON as /ws/requests/{request_id}
+    - {"type": "tracking_closed", "request_id": 1, "reason": "..."} → the
+      tracking channel ended, the subscription is gone
+    - {"type": "error", "request_id": 1, "detail": "..."}
+    - {"type": "ping"} / {"type": "pong"}
+
+    Client messages:
+    - {"type": "subscribe", "request_id": 1} → multiplex the tracking
+      channel of one of your ACCEPTED requests over this connection
+    - {"type": "unsubscribe", "request_id": 1}
+    - {"type": "ping"}
+
+    Connection Rules:
+    - At most NOTIFY_MAX_SOCKETS_PER_USER connections per account, the
+      oldest is closed (1013) beyond that
+    - Sockets silent for longer than the idle timeout are closed (1001)
+
+    🔒 Authentication required (Bearer token in headers)
+    """
+
+    # the socket stays open, don't hold the DB connection used for auth
+    await session.close()
+
+    await notifications.connect(cur_user.id, websocket)
+    await notifications.listen(websocket)
+
+
+
+
+
+
+@router.websocket("/ws/requests/{request_id}/nearby_mechanics")
+async def websocket_nearby_mechanics(websocket: WebSocket, request_id: int , radius_km: Optional[float] = None , cur_user : User = Depends(require_user_ws) , session : AsyncSession = Depends(get_async_session)):
+
+    """
+    Nearby mechanics WebSocket endpoint.
+
+    While the user's request is PENDING, streams the available mechanics
+    having the request's skill within radius_km of the request location
+    (default NEARBY_DEFAULT_RADIUS_KM, at most NEARBY_MAX_RADIUS_KM).
+
+    Server messages:
+    - {"type": "snapshot", "items": [{"id": "uuid", "name": "...",
+      "lat": 30.1, "lng": 31.2, "distance_km": 2.4}, ...]} → once, nearest first
+    - {"type": "deltas", "items": [{"op": "add" | "move", ...item},
+      {"op": "remove", "id": "uuid"}]} → batched, at most once per
+      FLEET_BATCH_INTERVAL seconds
+    - {"type": "ping"} / {"type": "pong"}
+
+    Connection Rules:
+    - Only the owner of the request can connect
+    - Request must be in PENDING status, the socket is closed (1000) once
+      it is accepted, canceled or deleted
+
+    🔒 User authentication required (Bearer token in headers)
+    """
+
+    if cur_user.role != "user":
+        await websocket.close(code=1008)
+        return
+
+    result = await session.execute(select(ServiceRequest).where(ServiceRequest.request_id == request_id))
+    request = result.scalar_one_or_none()
+    if not request or request.user_id != cur_user.id or request.status != Status.pending:
+        await websocket.close(code=1008)
+        return
+    if request.user_lat is None or request.user_lng is None:
+        await websocket.close(code=1008)
+        return
+
+    await fleet.warm(session)
+    await session.close()
+
+    watcher = NearbyWatcher(
+        websocket,
+        request_id,
+        float(request.user_lat),
+        float(request.user_lng),
+        clamp_radius(radius_km),
+        request.request_type,
+    )
+    if await nearby.connect(watcher):
+        await nearby.listen(websocket)
+
+
+
+
+
+
+@router.websocket("/ws/admin/fleet")
+async def websocket_fleet_map(websocket: WebSocket, cur_user : User = Depends(require_user_ws) , session : AsyncSession = Depends(get_async_session)):
+
+    """
+    Live fleet map WebSocket endpoint.
+
+    Streams positions and statuses of mechanics and active requests
+    inside the viewport the client subscribed to.
+
+    Client messages:
+    - {"type": "subscribe", "viewport": [min_lat, min_lng, max_lat, max_lng]}
+      (send again to move the viewport)
+    - {"type": "ping"}
+
+    Server messages:
+    - {"type": "snapshot", "items": [...]} → everything inside the viewport,
+      sent after every subscribe
+    - {"type": "deltas", "items": [...]} → batched changes, once per batch
+      interval at most. Items have "op": "upsert" or "remove", "kind":
+      "mechanic" or "request", "id", and for upserts "lat", "lng", "status"
+    - {"type": "error", "detail": "..."} → invalid or too large viewport
+
+    🔒 Authentication required (Bearer token in headers)  
+    🛡 Admin access required
+    """
+
+    if cur_user.role != "admin":
+        await websocket.close(code=1008)
+        return
+
+    await fleet.warm(session)
+    await session.close()
+
+    if not await fleet.connect(websocket):
+        return
+    await fleet.listen(websocket)
+
+
+
+
+
+
+@router.get(
+    "/tracking/requests/{request_id}/track",
+    status_code=200,
+    summary="Replay the track of a service request",
+    description="""
+Stream the stored mechanic positions of a service request, oldest first.
+
+Formats:
+- ndjson (default) → one JSON object per line:
+  {"lat": 30.1234, "lng": 31.5678, "timestamp": "ISO_DATETIME"}
+- csv → header line "lat,lng,timestamp" then one point per line
+
+Optional `points` down-samples the track to at most that many points
+(the last point is always included).
+
+The response is streamed from a server-side cursor, long tracks are
+never loaded into memory at once.
+
+Tracks of completed requests are compacted into an encoded polyline
+(location_track_archives) and decoded on the fly.
+
+🔒 Authentication required  
+🛡 Admin, or the user / mechanic of the request
+    """,
+    responses=swagger_responses(
+        success_message={"lat": 30.1234, "lng": 31.5678, "timestamp": "2024-01-01T10:00:00+00:00"},
+        access_role="Admin, user or mechanic of the request",
+        not_found=True,
+    ),
+)
+async def replay_request_track(
+    request_id: int,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    points: Optional[int] = Query(None, ge=2),
+    cur_user: User = Depends(require_any_role),
+    session: AsyncSession = Depends(get_async_session),
+):
+    result = await session.execute(
+        select(ServiceRequest.user_id, ServiceRequest.mechanic_id).where(
+            ServiceRequest.request_id == request_id
+        )
+    )
+    request = result.one_or_none()
+    if not request:
+        raise HTTPException(status_code=404, detail="Request not found")
+
+    if cur_user.role != "admin" and cur_user.id not in (request.user_id, request.mechanic_id):
+        raise HTTPException(status_code=403, detail="Access required")
+
+    await session.close()
+    # points still waiting in the write buffer belong in the replay
+    await breadcrumbs.flush()
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(stream_track(request_id, format, points), media_type=media_type)
+
+
+
+
+
+
+@router.get(
+    "/tracking/stats",
+    status_code=200,
+    summary="Get tracking WebSocket counters",
+    description="""
+Counters for the tracking WebSockets of this worker process.
+
+- open → sockets currently connected
+- binary → sockets using the binary frame subprotocol
+- channels → requests with at least one connected socket
+- opened / closed / evicted → totals since the process started
+- fleet → admin fleet map viewers and tracked entities
+- writer → live locations waiting for the next bulk write, rows written so far
+- sessions → cached active tracking sessions, cache hits and misses
+- breadcrumbs → track points waiting for the next bulk insert, rows inserted,
+  rows dropped because the buffer was full, tracks archived
+- gps_filter → requests with a filter state, fixes rejected as outliers
+- geofences → registered arrival fences, enter/exit/dwell events so far
+- notifications → users and sockets on /ws/notifications, tracking
+  subscriptions, status events sent
+- nearby → sockets watching the mechanics around a pending request
+- live → entries held per request by every tracking structure; channels
+  are torn down on each terminal transition, so all of these drop back
+  to 0 when nothing is being tracked
+
+🔒 Authentication required  
+🛡 Admin access required
+    """,
+    responses=swagger_responses(
+        success_message={
+            "open": 12,
+            "binary": 3,
+            "channels": 9,
+            "opened": 340,
+            "closed": 328,
+            "evicted": 4,
+            "upstream": 30,
+            "fleet": {"viewers": 2, "entities": 830},
+            "writer": {"buffered": 40, "flushed_rows": 51234},
+            "sessions": {"active": 41, "hits": 98012, "misses": 57},
+            "breadcrumbs": {"buffered": 120, "inserted_rows": 88410, "dropped_rows": 0, "archived_tracks": 310},
+            "gps_filter": {"filtered_requests": 41, "rejected_fixes": 87},
+            "geofences": {"fences": 41, "events": {"enter": 290, "exit": 12, "dwell": 270}},
+            "notifications": {"users": 120, "sockets": 131, "subscriptions": 14, "sent_events": 5210},
+            "nearby": {"watchers": 25},
+            "candidates": {"mechanics": 790, "capacity": 1024},
+            "live": {"channels": 9, "upstream": 30, "pending_frames": 2, "flush_tasks": 2, "rate_windows": 9, "sessions": 41, "positions": 41, "eta_windows": 41, "gps_filters": 41, "geofences": 41, "write_buffer": 40},
+        },
+        access_role="Admin",
+    ),
+)
+async def get_tracking_stats(admin = Depends(require_admin)):
+    return {
+        **manager.stats(),
+        "fleet": fleet.stats(),
+        "writer": location_writer.stats(),
+        "sessions": tracking_sessions.stats(),
+        "breadcrumbs": breadcrumbs.stats(),
+        "gps_filter": gps_filter.stats(),
+        "geofences": geofences.stats(),
+        "live": tracking_gauges(),
+        "notifications": notifications.stats(),
+        "nearby": nearby.stats(),
+        "candidates": candidates.stats(),
+    }
 
-    try:
-        while True:
-            await asyncio.sleep(60)
-    except WebSocketDisconnect:
-        manager.disconnect(request_id, websocket)
@@ -0,0 +1,365 @@
+import asyncio
+import logging
+import math
+import os
+from collections import deque
+from datetime import date, datetime, time, timedelta, timezone
+from typing import List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, insert, select, text, tuple_
+from sqlalchemy.exc import IntegrityError
+
+from app.db.models import (
+    LocationBreadcrumb,
+    LocationTrackArchive,
+    ServiceRequest,
+    async_session_maker,
+    engine,
+)
+from dependencies.helper import Status
+from services.polyline import decode_deltas, decode_polyline, encode_deltas, encode_polyline
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+BREADCRUMB_FLUSH_INTERVAL = float(os.getenv("BREADCRUMB_FLUSH_INTERVAL", "10"))
+# daily partitions older than this are dropped, 0 keeps everything
+BREADCRUMB_RETENTION_DAYS = int(os.getenv("BREADCRUMB_RETENTION_DAYS", "90"))
+BREADCRUMB_PARTITIONS_AHEAD = int(os.getenv("BREADCRUMB_PARTITIONS_AHEAD", "3"))
+BREADCRUMB_MAINTENANCE_INTERVAL = float(os.getenv("BREADCRUMB_MAINTENANCE_INTERVAL", "3600"))
+# Douglas-Peucker tolerance applied to a track once the request is finished,
+# 0 keeps every stored point
+BREADCRUMB_SIMPLIFY_TOLERANCE_M = float(os.getenv("BREADCRUMB_SIMPLIFY_TOLERANCE_M", "0"))
+# compact the breadcrumbs of completed requests into location_track_archives
+BREADCRUMB_ARCHIVE_COMPLETED = os.getenv("BREADCRUMB_ARCHIVE_COMPLETED", "true").lower() == "true"
+# points kept in memory at most while the DB is unreachable
+BREADCRUMB_MAX_BUFFERED = int(os.getenv("BREADCRUMB_MAX_BUFFERED", "100000"))
+
+PARTITION_PREFIX = "location_breadcrumbs_p"
+
+EARTH_RADIUS_M = 6371000
+
+
+def partition_name(day: date) -> str:
+    return f"{PARTITION_PREFIX}{day:%Y%m%d}"
+
+
+def douglas_peucker(points: Sequence[Tuple[float, float]], tolerance_m: float) -> List[int]:
+    # Indices of the points kept by Douglas-Peucker. Points are (lat, lng);
+    # distances use an equirectangular projection around the first point,
+    # which is accurate to well under a meter at city scale.
+    if len(points) <= 2 or tolerance_m <= 0:
+        return list(range(len(points)))
+
+    lat0 = math.radians(points[0][0])
+    cos_lat0 = math.cos(lat0)
+    xy = [
+        (
+            math.radians(lng) * cos_lat0 * EARTH_RADIUS_M,
+            math.radians(lat) * EARTH_RADIUS_M,
+        )
+        for lat, lng in points
+    ]
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+
+    while stack:
+        first, last = stack.pop()
+        ax, ay = xy[first]
+        bx, by = xy[last]
+        dx, dy = bx - ax, by - ay
+        length = math.hypot(dx, dy)
+
+        farthest, max_distance = None, tolerance_m
+        for index in range(first + 1, last):
+            px, py = xy[index]
+            if length == 0:
+                distance = math.hypot(px - ax, py - ay)
+            else:
+                distance = abs(dy * px - dx * py + bx * ay - by * ax) / length
+            if distance > max_distance:
+                farthest, max_distance = index, distance
+
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+
+    return [index for index, kept in enumerate(keep) if kept]
+
+
+def decode_archive(archive: LocationTrackArchive) -> List[Tuple[float, float, datetime]]:
+    points = decode_polyline(archive.polyline)
+    offsets = decode_deltas(archive.time_offsets)
+    return [
+        (lat, lng, archive.started_at + timedelta(milliseconds=offset))
+        for (lat, lng), offset in zip(points, offsets)
+    ]
+
+
+class BreadcrumbStore:
+    # Append-only history of stored live locations. Points are buffered and
+    # written with one multi-row INSERT per flush; the table is partitioned by
+    # day so retention is a DROP TABLE of whole partitions.
+
+    def __init__(self):
+        self.pending: deque = deque(maxlen=BREADCRUMB_MAX_BUFFERED)
+        self.tasks: List[asyncio.Task] = []
+        self.finishing: set = set()
+        self.inserted_rows = 0
+        self.dropped_rows = 0
+        self.archived_tracks = 0
+
+    def add(self, request_id: int, lat: float, lng: float, recorded_at: datetime):
+        if len(self.pending) == self.pending.maxlen:
+            self.dropped_rows += 1
+        self.pending.append(
+            {
+                "request_id": request_id,
+                "mechanic_lat": lat,
+                "mechanic_lng": lng,
+                "recorded_at": recorded_at,
+            }
+        )
+
+    async def flush(self):
+        if not self.pending:
+            return
+        rows = list(self.pending)
+        self.pending.clear()
+        try:
+            async with async_session_maker() as session:
+                await session.execute(insert(LocationBreadcrumb), rows)
+                await session.commit()
+        except IntegrityError:
+            # a request deleted meanwhile would fail every retry of this batch
+            logger.exception("dropping %s breadcrumbs that can't be inserted", len(rows))
+            self.dropped_rows += len(rows)
+            return
+        except Exception:
+            # put them back in front of newer points, the oldest go first if full
+            self.pending = deque(rows + list(self.pending), maxlen=BREADCRUMB_MAX_BUFFERED)
+            raise
+        self.inserted_rows += len(rows)
+
+    async def write(self, rows: List[dict], session):
+        # Inserts rows directly in the caller's transaction, bypassing the
+        # buffer; the caller commits.
+        if not rows:
+            return
+        await session.execute(insert(LocationBreadcrumb), rows)
+        self.inserted_rows += len(rows)
+
+    async def simplify_track(self, request_id: int, tolerance_m: float = BREADCRUMB_SIMPLIFY_TOLERANCE_M):
+        # Runs once the request is finished: deletes the points Douglas-Peucker
+        # drops, keeping the shape of the route within tolerance_m.
+        if tolerance_m <= 0:
+            return
+        await self.flush()
+
+        async with async_session_maker() as session:
+            result = await session.execute(
+                select(
+                    LocationBreadcrumb.breadcrumb_id,
+                    LocationBreadcrumb.recorded_at,
+                    LocationBreadcrumb.mechanic_lat,
+                    LocationBreadcrumb.mechanic_lng,
+                )
+                .where(LocationBreadcrumb.request_id == request_id)
+                .order_by(LocationBreadcrumb.recorded_at)
+            )
+            rows = result.all()
+            kept = set(douglas_peucker([(float(row[2]), float(row[3])) for row in rows], tolerance_m))
+            dropped = [(row[0], row[1]) for index, row in enumerate(rows) if index not in kept]
+            if not dropped:
+                return
+
+            for start in range(0, len(dropped), 1000):
+                await session.execute(
+                    delete(LocationBreadcrumb).where(
+                        tuple_(LocationBreadcrumb.breadcrumb_id, LocationBreadcrumb.recorded_at).in_(
+                            dropped[start:start + 1000]
+                        )
+                    )
+                )
+            await session.commit()
+
+    async def archive_track(self, request_id: int):
+        # Compacts the breadcrumbs of a finished request into its
+        # location_track_archives row (encoded polyline plus delta encoded
+        # time offsets) and deletes them. Points archived before are merged.
+        await self.flush()
+
+        async with async_session_maker() as session:
+            result = await session.execute(
+                select(
+                    LocationBreadcrumb.mechanic_lat,
+                    LocationBreadcrumb.mechanic_lng,
+                    LocationBreadcrumb.recorded_at,
+                )
+                .where(LocationBreadcrumb.request_id == request_id)
+                .order_by(LocationBreadcrumb.recorded_at)
+            )
+            rows = [(float(lat), float(lng), recorded_at) for lat, lng, recorded_at in result.all()]
+            if not rows:
+                return
+            last_recorded_at = rows[-1][2]
+
+            archive = await session.get(LocationTrackArchive, request_id)
+            if archive is not None:
+                rows = sorted(decode_archive(archive) + rows, key=lambda row: row[2])
+
+            started_at = rows[0][2]
+            polyline = encode_polyline([(lat, lng) for lat, lng, _ in rows])
+            time_offsets = encode_deltas(
+                [round((recorded_at - started_at).total_seconds() * 1000) for _, _, recorded_at in rows]
+            )
+
+            if archive is None:
+                session.add(
+                    LocationTrackArchive(
+                        request_id=request_id,
+                        point_count=len(rows),
+                        started_at=started_at,
+                        polyline=polyline,
+                        time_offsets=time_offsets,
+                    )
+                )
+            else:
+                archive.point_count = len(rows)
+                archive.started_at = started_at
+                archive.polyline = polyline
+                archive.time_offsets = time_offsets
+
+            await session.execute(
+                delete(LocationBreadcrumb).where(
+                    LocationBreadcrumb.request_id == request_id,
+                    LocationBreadcrumb.recorded_at <= last_recorded_at,
+                )
+            )
+            await session.commit()
+        self.archived_tracks += 1
+
+    async def archive_completed(self, limit: int = 100):
+        # catches completed requests whose archiving failed or never ran
+        async with async_session_maker() as session:
+            result = await session.execute(
+                select(LocationBreadcrumb.request_id)
+                .join(ServiceRequest, ServiceRequest.request_id == LocationBreadcrumb.request_id)
+                .where(ServiceRequest.status == Status.completed)
+                .distinct()
+                .limit(limit)
+            )
+            request_ids = result.scalars().all()
+        for request_id in request_ids:
+            await self.archive_track(request_id)
+
+    def finish_track(self, request_id: int, archive: bool = False):
+        # fire and forget, the transition handler doesn't wait for the rewrite
+        archive = archive and BREADCRUMB_ARCHIVE_COMPLETED
+        if BREADCRUMB_SIMPLIFY_TOLERANCE_M <= 0 and not archive:
+            return
+        task = asyncio.create_task(self._finish_track(request_id, archive))
+        self.finishing.add(task)
+        task.add_done_callback(self.finishing.discard)
+
+    async def _finish_track(self, request_id: int, archive: bool):
+        try:
+            await self.simplify_track(request_id)
+            if archive:
+                await self.archive_track(request_id)
+        except Exception:
+            logger.exception("finishing track of request %s failed", request_id)
+
+    # ------------------------------------------------------------ partitions
+
+    async def ensure_partitions(self, today: Optional[date] = None):
+        if engine.dialect.name != "postgresql":
+            return
+        today = today or datetime.now(timezone.utc).date()
+        async with engine.begin() as conn:
+            for offset in range(BREADCRUMB_PARTITIONS_AHEAD + 1):
+                day = today + timedelta(days=offset)
+                start = datetime.combine(day, time.min, tzinfo=timezone.utc)
+                end = start + timedelta(days=1)
+                await conn.execute(
+                    text(
+                        f"CREATE TABLE IF NOT EXISTS {partition_name(day)} "
+                        f"PARTITION OF location_breadcrumbs "
+                        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                    )
+                )
+
+    async def drop_expired_partitions(self, today: Optional[date] = None):
+        if engine.dialect.name != "postgresql" or BREADCRUMB_RETENTION_DAYS <= 0:
+            return
+        today = today or datetime.now(timezone.utc).date()
+        cutoff = today - timedelta(days=BREADCRUMB_RETENTION_DAYS)
+
+        async with engine.begin() as conn:
+            result = await conn.execute(
+                text(
+                    "SELECT child.relname FROM pg_inherits "
+                    "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+                    "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                    "WHERE parent.relname = 'location_breadcrumbs'"
+                )
+            )
+            for (name,) in result.all():
+                try:
+                    day = datetime.strptime(name[len(PARTITION_PREFIX):], "%Y%m%d").date()
+                except ValueError:
+                    continue
+                if day < cutoff:
+                    await conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+
+    # ------------------------------------------------------------ background
+
+    async def run_flush(self):
+        while True:
+            await asyncio.sleep(BREADCRUMB_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("breadcrumb flush failed")
+
+    async def run_maintenance(self):
+        while True:
+            try:
+                await self.ensure_partitions()
+                await self.drop_expired_partitions()
+                if BREADCRUMB_ARCHIVE_COMPLETED:
+                    await self.archive_completed()
+            except Exception:
+                logger.exception("breadcrumb partition maintenance failed")
+            await asyncio.sleep(BREADCRUMB_MAINTENANCE_INTERVAL)
+
+    def start(self):
+        self.tasks.append(asyncio.create_task(self.run_flush()))
+        self.tasks.append(asyncio.create_task(self.run_maintenance()))
+
+    async def stop(self):
+        for task in list(self.tasks):
+            task.cancel()
+        for task in list(self.tasks):
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self.tasks.clear()
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self.pending),
+            "inserted_rows": self.inserted_rows,
+            "dropped_rows": self.dropped_rows,
+            "archived_tracks": self.archived_tracks,
+        }
+
+
+breadcrumbs = BreadcrumbStore()
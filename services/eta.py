@@ -0,0 +1,102 @@
+import math
+import os
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+from services.distance import haversine_distance
+
+load_dotenv()
+
+# recent fixes kept per request to derive speed and heading
+ETA_WINDOW_POINTS = int(os.getenv("ETA_WINDOW_POINTS", "8"))
+# used until the window has enough movement to measure a speed
+ETA_DEFAULT_SPEED_KMH = float(os.getenv("ETA_DEFAULT_SPEED_KMH", "30"))
+# floor so a mechanic waiting at a light doesn't get an infinite ETA
+ETA_MIN_SPEED_KMH = float(os.getenv("ETA_MIN_SPEED_KMH", "10"))
+# straight-line distance times this factor approximates the road distance
+ETA_ROUTE_FACTOR = float(os.getenv("ETA_ROUTE_FACTOR", "1.3"))
+
+
+class TrackWindow:
+    # Fixed-size window of recent fixes. The path length and time span of the
+    # window are kept as running sums, so each fix costs O(1).
+
+    def __init__(self, size: int):
+        # (monotonic time, lat, lng)
+        self.points = deque(maxlen=size)
+        # meters between consecutive points, segments[i] ends at points[i + 1]
+        self.segments = deque(maxlen=size - 1)
+        self.path_m = 0.0
+        self.heading: Optional[float] = None
+
+    def add(self, at: float, lat: float, lng: float):
+        if self.points:
+            _, last_lat, last_lng = self.points[-1]
+            segment = haversine_distance(last_lat, last_lng, lat, lng, km=False)
+            if len(self.segments) == self.segments.maxlen:
+                self.path_m -= self.segments[0]
+            self.segments.append(segment)
+            self.path_m += segment
+            if segment > 1:
+                self.heading = _bearing(last_lat, last_lng, lat, lng)
+        self.points.append((at, lat, lng))
+
+    def speed_mps(self) -> Optional[float]:
+        if len(self.points) < 2:
+            return None
+        span = self.points[-1][0] - self.points[0][0]
+        if span <= 0:
+            return None
+        return self.path_m / span
+
+
+class EtaEstimator:
+    def __init__(self, window_points: int = ETA_WINDOW_POINTS):
+        self.window_points = max(window_points, 2)
+        # request_id -> window of its recent fixes
+        self.windows: Dict[int, TrackWindow] = {}
+
+    def update(
+        self,
+        request_id: int,
+        lat: float,
+        lng: float,
+        dest_lat: float,
+        dest_lng: float,
+        at: Optional[float] = None,
+    ) -> dict:
+        window = self.windows.get(request_id)
+        if window is None:
+            window = self.windows[request_id] = TrackWindow(self.window_points)
+        window.add(time.monotonic() if at is None else at, lat, lng)
+
+        remaining_m = haversine_distance(lat, lng, dest_lat, dest_lng, km=False)
+
+        speed = window.speed_mps()
+        if speed is None:
+            speed = ETA_DEFAULT_SPEED_KMH / 3.6
+        speed = max(speed, ETA_MIN_SPEED_KMH / 3.6)
+
+        return {
+            "eta_seconds": round(remaining_m * ETA_ROUTE_FACTOR / speed),
+            "remaining_km": round(remaining_m / 1000, 2),
+            "speed_kmh": round(speed * 3.6, 1),
+            "heading": round(window.heading) if window.heading is not None else None,
+        }
+
+    def drop(self, request_id: int):
+        self.windows.pop(request_id, None)
+
+
+def _bearing(lat1, lng1, lat2, lng2) -> float:
+    lat1, lng1, lat2, lng2 = map(math.radians, [lat1, lng1, lat2, lng2])
+    dlng = lng2 - lng1
+    x = math.sin(dlng) * math.cos(lat2)
+    y = math.cos(lat1) * math.sin(lat2) - math.sin(lat1) * math.cos(lat2) * math.cos(dlng)
+    return (math.degrees(math.atan2(x, y)) + 360) % 360
+
+
+eta_estimator = EtaEstimator()
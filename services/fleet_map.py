@@ -0,0 +1,311 @@
+import asyncio
+import json
+import os
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi import WebSocket, WebSocketDisconnect
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import ServiceRequest, User
+from dependencies.helper import Status
+from services.skill_mask import mask_skills
+from services.spatial_index import GridIndex
+from services.webscoket_manager import (
+    CLOSE_GOING_AWAY,
+    CLOSE_TRY_AGAIN_LATER,
+    HEARTBEAT_INTERVAL,
+    IDLE_TIMEOUT,
+    SEND_TIMEOUT,
+)
+
+
+# ~5.5 km cells, a city-sized viewport covers a few hundred cells
+FLEET_CELL_DEG = float(os.getenv("FLEET_CELL_DEG", "0.05"))
+FLEET_BATCH_INTERVAL = float(os.getenv("FLEET_BATCH_INTERVAL", "1"))
+FLEET_MAX_VIEWPORT_CELLS = int(os.getenv("FLEET_MAX_VIEWPORT_CELLS", "4096"))
+FLEET_MAX_VIEWERS = int(os.getenv("FLEET_MAX_VIEWERS", "100"))
+
+ACTIVE_STATUSES = (Status.pending, Status.accepted, Status.arrived)
+
+
+class FleetViewer:
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        # (min_lat, min_lng, max_lat, max_lng)
+        self.viewport: Optional[Tuple[float, float, float, float]] = None
+        self.cells = []
+        # entity key -> newest delta for it since the last batch
+        self.pending: Dict[str, dict] = {}
+        self.last_seen = time.monotonic()
+
+    def contains(self, lat: float, lng: float) -> bool:
+        if self.viewport is None:
+            return False
+        min_lat, min_lng, max_lat, max_lng = self.viewport
+        return min_lat <= lat <= max_lat and min_lng <= lng <= max_lng
+
+
+class FleetMap:
+    def __init__(self):
+        # "mechanic:<uuid>" / "request:<id>" -> entity dict
+        self.entities: Dict[str, dict] = {}
+        self.entity_index = GridIndex(FLEET_CELL_DEG)
+        self.viewer_index = GridIndex(FLEET_CELL_DEG)
+        self.viewers: Dict[WebSocket, FleetViewer] = {}
+        self.loaded = False
+        self.flush_task: Optional[asyncio.Task] = None
+        # called with (key, entity or None once removed, previous position)
+        # after every change, see services/nearby_mechanics.py
+        self.listeners: List[Callable] = []
+
+    # ---------------------------------------------------------------- updates
+
+    def update(self, kind: str, entity_id, lat=None, lng=None, **fields):
+        key = f"{kind}:{entity_id}"
+        entity = self.entities.get(key)
+
+        if entity is None:
+            if lat is None or lng is None:
+                return
+            entity = {"kind": kind, "id": str(entity_id)}
+            self.entities[key] = entity
+            old = None
+        else:
+            old = (entity["lat"], entity["lng"])
+
+        if lat is not None and lng is not None:
+            entity["lat"] = float(lat)
+            entity["lng"] = float(lng)
+        entity.update(fields)
+        new = (entity["lat"], entity["lng"])
+
+        new_cell = self.entity_index.cell_of(*new)
+        old_cell = self.entity_index.cell_of(*old) if old else None
+        if old_cell != new_cell:
+            if old_cell is not None:
+                self.entity_index.discard(key, [old_cell])
+            self.entity_index.add(key, [new_cell])
+
+        for listener in self.listeners:
+            listener(key, entity, old)
+
+        if not self.viewers:
+            return
+
+        candidates = set(self.viewer_index.members(new_cell))
+        if old_cell is not None and old_cell != new_cell:
+            candidates |= self.viewer_index.members(old_cell)
+
+        for websocket in candidates:
+            viewer = self.viewers[websocket]
+            if viewer.contains(*new):
+                viewer.pending[key] = {"op": "upsert", **entity}
+            elif old and viewer.contains(*old):
+                viewer.pending[key] = {"op": "remove", "kind": kind, "id": str(entity_id)}
+
+    def remove(self, kind: str, entity_id):
+        key = f"{kind}:{entity_id}"
+        entity = self.entities.pop(key, None)
+        if entity is None:
+            return
+
+        cell = self.entity_index.cell_of(entity["lat"], entity["lng"])
+        self.entity_index.discard(key, [cell])
+
+        for listener in self.listeners:
+            listener(key, None, (entity["lat"], entity["lng"]))
+
+        for websocket in self.viewer_index.members(cell):
+            viewer = self.viewers[websocket]
+            if viewer.contains(entity["lat"], entity["lng"]):
+                viewer.pending[key] = {"op": "remove", "kind": kind, "id": str(entity_id)}
+
+    async def return_to_workshop(self, mechanic_id, session: AsyncSession):
+        # Once a job ends the mechanic is shown at the workshop again, the
+        # position the REST ranking and the accept path use, instead of at
+        # the last customer the live fixes left them at.
+        result = await session.execute(
+            select(User.workshop_lat, User.workshop_lng).where(User.id == mechanic_id)
+        )
+        workshop = result.one_or_none()
+        if workshop is not None:
+            self.update("mechanic", mechanic_id, workshop.workshop_lat, workshop.workshop_lng)
+
+    async def warm(self, session: AsyncSession):
+        # Loaded once per process; entities that already received live
+        # updates keep what those set, the DB only fills the gaps.
+        if self.loaded:
+            return
+
+        result = await session.execute(
+            select(
+                User.id,
+                User.name,
+                User.workshop_lat,
+                User.workshop_lng,
+                User.is_available,
+                User.skill_mask,
+            ).where(
+                User.role == "mechanic",
+                User.workshop_lat.is_not(None),
+                User.workshop_lng.is_not(None),
+            )
+        )
+
+        for mechanic_id, name, lat, lng, is_available, mask in result.all():
+            entity = self.entities.get(f"mechanic:{mechanic_id}")
+            if entity is None:
+                self.update(
+                    "mechanic",
+                    mechanic_id,
+                    lat,
+                    lng,
+                    name=name,
+                    status="available" if is_available else "unavailable",
+                    skills=mask_skills(mask),
+                    skill_mask=mask,
+                )
+            else:
+                # Created by a live update or a workshop move before the
+                # fleet was loaded: the position is newer than the DB, the
+                # fields that update didn't set are filled in.
+                fields = {
+                    "name": name,
+                    "status": "available" if is_available else "unavailable",
+                    "skills": mask_skills(mask),
+                    "skill_mask": mask,
+                }
+                missing = {field: value for field, value in fields.items() if field not in entity}
+                if missing:
+                    self.update("mechanic", mechanic_id, **missing)
+
+        result = await session.execute(
+            select(
+                ServiceRequest.request_id,
+                ServiceRequest.user_lat,
+                ServiceRequest.user_lng,
+                ServiceRequest.status,
+                ServiceRequest.request_type,
+            ).where(
+                ServiceRequest.status.in_(ACTIVE_STATUSES),
+                ServiceRequest.user_lat.is_not(None),
+                ServiceRequest.user_lng.is_not(None),
+            )
+        )
+        for request_id, lat, lng, status, request_type in result.all():
+            if f"request:{request_id}" not in self.entities:
+                self.update("request", request_id, lat, lng, status=status, type=request_type)
+
+        self.loaded = True
+
+    # ---------------------------------------------------------------- viewers
+
+    async def connect(self, websocket: WebSocket) -> bool:
+        await websocket.accept()
+        if len(self.viewers) >= FLEET_MAX_VIEWERS:
+            await websocket.close(code=CLOSE_TRY_AGAIN_LATER, reason="too many viewers")
+            return False
+
+        self.viewers[websocket] = FleetViewer(websocket)
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self._flush_loop())
+        return True
+
+    def disconnect(self, websocket: WebSocket):
+        viewer = self.viewers.pop(websocket, None)
+        if viewer is not None:
+            self.viewer_index.discard(websocket, viewer.cells)
+
+    async def subscribe(self, viewer: FleetViewer, viewport) -> Optional[str]:
+        try:
+            min_lat, min_lng, max_lat, max_lng = (float(value) for value in viewport)
+        except (TypeError, ValueError):
+            return "viewport must be [min_lat, min_lng, max_lat, max_lng]"
+        if min_lat > max_lat or min_lng > max_lng:
+            return "viewport min must not exceed max"
+        if self.viewer_index.count_cells(min_lat, min_lng, max_lat, max_lng) > FLEET_MAX_VIEWPORT_CELLS:
+            return "viewport too large"
+
+        cells = self.viewer_index.cells_covering(min_lat, min_lng, max_lat, max_lng)
+        self.viewer_index.discard(viewer.websocket, viewer.cells)
+        self.viewer_index.add(viewer.websocket, cells)
+        viewer.cells = cells
+        viewer.viewport = (min_lat, min_lng, max_lat, max_lng)
+        viewer.pending.clear()
+
+        items = []
+        for cell in cells:
+            for key in self.entity_index.members(cell):
+                entity = self.entities[key]
+                if viewer.contains(entity["lat"], entity["lng"]):
+                    items.append(entity)
+
+        await self._send(viewer, {"type": "snapshot", "items": items})
+        return None
+
+    async def listen(self, websocket: WebSocket):
+        viewer = self.viewers[websocket]
+        try:
+            while websocket in self.viewers:
+                try:
+                    message = await asyncio.wait_for(
+                        websocket.receive(), timeout=HEARTBEAT_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    if time.monotonic() - viewer.last_seen >= IDLE_TIMEOUT:
+                        await websocket.close(code=CLOSE_GOING_AWAY, reason="idle timeout")
+                        return
+                    await self._send(viewer, {"type": "ping"})
+                    continue
+
+                if message["type"] == "websocket.disconnect":
+                    break
+                viewer.last_seen = time.monotonic()
+
+                try:
+                    data = json.loads(message.get("text") or "")
+                except ValueError:
+                    continue
+                if not isinstance(data, dict):
+                    continue
+
+                if data.get("type") == "ping":
+                    await self._send(viewer, {"type": "pong"})
+                elif data.get("type") == "subscribe":
+                    error = await self.subscribe(viewer, data.get("viewport"))
+                    if error:
+                        await self._send(viewer, {"type": "error", "detail": error})
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+        finally:
+            self.disconnect(websocket)
+
+    async def _send(self, viewer: FleetViewer, data: dict):
+        try:
+            await asyncio.wait_for(
+                viewer.websocket.send_text(json.dumps(data, default=str)),
+                timeout=SEND_TIMEOUT,
+            )
+        except Exception:
+            self.disconnect(viewer.websocket)
+
+    async def _flush_loop(self):
+        while self.viewers:
+            await asyncio.sleep(FLEET_BATCH_INTERVAL)
+            for viewer in list(self.viewers.values()):
+                if not viewer.pending:
+                    continue
+                items = list(viewer.pending.values())
+                viewer.pending.clear()
+                await self._send(viewer, {"type": "deltas", "items": items})
+
+    def stats(self) -> dict:
+        return {
+            "viewers": len(self.viewers),
+            "entities": len(self.entities),
+        }
+
+
+fleet = FleetMap()
@@ -0,0 +1,111 @@
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from services.distance import haversine_distance
+
+load_dotenv()
+
+# a fix within this distance of the customer enters the fence
+GEOFENCE_RADIUS_M = float(os.getenv("GEOFENCE_RADIUS_M", "25"))
+# once inside, the fence is only left beyond radius + hysteresis, so GPS
+# noise at the edge doesn't produce enter/exit flapping
+GEOFENCE_HYSTERESIS_M = float(os.getenv("GEOFENCE_HYSTERESIS_M", "15"))
+# seconds inside the fence before a dwell event
+GEOFENCE_DWELL_S = float(os.getenv("GEOFENCE_DWELL_S", "60"))
+# arrival is triggered by entering the fence, or with "dwell" only after
+# staying inside GEOFENCE_DWELL_S, which ignores drive-bys
+GEOFENCE_ARRIVAL_EVENT = os.getenv("GEOFENCE_ARRIVAL_EVENT", "enter")
+
+ENTER = "enter"
+EXIT = "exit"
+DWELL = "dwell"
+
+
+class Fence:
+    __slots__ = ("lat", "lng", "radius_m", "exit_radius_m", "inside", "entered_at", "dwelled")
+
+    def __init__(self, lat: float, lng: float, radius_m: float, hysteresis_m: float):
+        self.lat = lat
+        self.lng = lng
+        self.radius_m = radius_m
+        self.exit_radius_m = radius_m + hysteresis_m
+        self.inside = False
+        self.entered_at: Optional[float] = None
+        self.dwelled = False
+
+
+class GeofenceRegistry:
+    # Circular fence around the customer of every active request, keyed by
+    # request_id. Evaluating a fix is one dict lookup and one haversine.
+
+    def __init__(self):
+        self.fences: Dict[int, Fence] = {}
+        self.event_counts: Dict[str, int] = {ENTER: 0, EXIT: 0, DWELL: 0}
+
+    def register(
+        self,
+        request_id: int,
+        lat: float,
+        lng: float,
+        radius_m: float = GEOFENCE_RADIUS_M,
+        hysteresis_m: float = GEOFENCE_HYSTERESIS_M,
+    ) -> Fence:
+        fence = self.fences[request_id] = Fence(lat, lng, radius_m, hysteresis_m)
+        return fence
+
+    def evaluate(
+        self,
+        request_id: int,
+        lat: float,
+        lng: float,
+        at: Optional[float] = None,
+        center: Optional[Tuple[float, float]] = None,
+    ) -> List[str]:
+        # Events caused by this fix, in order. A request without a fence gets
+        # one around `center` with the default radius.
+        fence = self.fences.get(request_id)
+        if fence is None:
+            if center is None:
+                return []
+            fence = self.register(request_id, *center)
+
+        at = time.time() if at is None else at
+        distance = haversine_distance(fence.lat, fence.lng, lat, lng, km=False)
+        events = []
+
+        if not fence.inside and distance <= fence.radius_m:
+            fence.inside = True
+            fence.entered_at = at
+            fence.dwelled = False
+            events.append(ENTER)
+        elif fence.inside and distance > fence.exit_radius_m:
+            fence.inside = False
+            fence.entered_at = None
+            events.append(EXIT)
+
+        if fence.inside and not fence.dwelled and at - fence.entered_at >= GEOFENCE_DWELL_S:
+            fence.dwelled = True
+            events.append(DWELL)
+
+        for event in events:
+            self.event_counts[event] += 1
+        return events
+
+    def drop(self, request_id: int):
+        self.fences.pop(request_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "fences": len(self.fences),
+            "events": dict(self.event_counts),
+        }
+
+
+def is_arrival(events: List[str]) -> bool:
+    return GEOFENCE_ARRIVAL_EVENT in events
+
+
+geofences = GeofenceRegistry()
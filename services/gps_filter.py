@@ -0,0 +1,148 @@
+import math
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from services.distance import haversine_distance
+
+load_dotenv()
+
+# fixes implying a faster move than this since the last accepted one are outliers
+GPS_MAX_SPEED_KMH = float(os.getenv("GPS_MAX_SPEED_KMH", "160"))
+# jumps shorter than this are never treated as outliers, whatever the speed
+GPS_MIN_OUTLIER_M = float(os.getenv("GPS_MIN_OUTLIER_M", "50"))
+# after this many outliers in a row the fix is taken as the new position
+GPS_MAX_REJECTED = int(os.getenv("GPS_MAX_REJECTED", "3"))
+# assumed accuracy of a phone fix
+GPS_ACCURACY_M = float(os.getenv("GPS_ACCURACY_M", "10"))
+# how hard the vehicle may change its velocity, m/s²
+GPS_ACCEL_NOISE_MPS2 = float(os.getenv("GPS_ACCEL_NOISE_MPS2", "3"))
+# spread of the velocity of a request seen for the first time, m/s
+GPS_INITIAL_SPEED_MPS = float(os.getenv("GPS_INITIAL_SPEED_MPS", "20"))
+
+METERS_PER_DEG = 6371000 * math.pi / 180
+
+
+class KalmanState:
+    # Constant-velocity Kalman filter, as commonly used for phone fixes.
+    # Position and velocity are kept in metres east/north of the first fix;
+    # both axes share one covariance since they have the same dynamics and
+    # noise. Constant size per request.
+
+    __slots__ = (
+        "lat0", "lng0", "scale", "x", "y", "vx", "vy",
+        "p_pos", "p_cross", "p_vel", "at", "raw_lat", "raw_lng", "raw_at", "rejected",
+    )
+
+    def __init__(self, lat: float, lng: float, at: float):
+        self.lat0 = lat
+        self.lng0 = lng
+        self.scale = math.cos(math.radians(lat))
+        self.x = self.y = 0.0
+        self.vx = self.vy = 0.0
+        self.p_pos = GPS_ACCURACY_M ** 2
+        self.p_cross = 0.0
+        self.p_vel = GPS_INITIAL_SPEED_MPS ** 2
+        self.at = at
+        # last accepted raw fix, what the speed gate measures against
+        self.raw_lat = lat
+        self.raw_lng = lng
+        self.raw_at = at
+        self.rejected = 0
+
+    def position(self) -> Tuple[float, float]:
+        lat = self.lat0 + self.y / METERS_PER_DEG
+        lng = self.lng0 + self.x / (METERS_PER_DEG * self.scale)
+        return round(lat, 6), round(lng, 6)
+
+    def update(self, lat: float, lng: float, at: float):
+        dt = max(at - self.at, 0)
+
+        # predict: move along the velocity, the uncertainty grows with the
+        # possible acceleration
+        self.x += self.vx * dt
+        self.y += self.vy * dt
+        q = GPS_ACCEL_NOISE_MPS2 ** 2
+        p_pos = self.p_pos + 2 * dt * self.p_cross + dt * dt * self.p_vel + q * dt ** 4 / 4
+        p_cross = self.p_cross + dt * self.p_vel + q * dt ** 3 / 2
+        p_vel = self.p_vel + q * dt ** 2
+
+        # correct with the measured position
+        gain_pos = p_pos / (p_pos + GPS_ACCURACY_M ** 2)
+        gain_vel = p_cross / (p_pos + GPS_ACCURACY_M ** 2)
+        dx = (lng - self.lng0) * METERS_PER_DEG * self.scale - self.x
+        dy = (lat - self.lat0) * METERS_PER_DEG - self.y
+        self.x += gain_pos * dx
+        self.y += gain_pos * dy
+        self.vx += gain_vel * dx
+        self.vy += gain_vel * dy
+        self.p_pos = (1 - gain_pos) * p_pos
+        self.p_cross = (1 - gain_pos) * p_cross
+        self.p_vel = p_vel - gain_vel * p_cross
+        self.at = at
+
+        self.raw_lat = lat
+        self.raw_lng = lng
+        self.raw_at = at
+
+
+class GpsFilter:
+    # Smooths incoming fixes per request and rejects jumps no vehicle could
+    # make, before the movement threshold and the arrival check see them.
+
+    def __init__(self):
+        self.states: Dict[int, KalmanState] = {}
+        self.rejected_fixes = 0
+
+    def apply(
+        self,
+        request_id: int,
+        lat: float,
+        lng: float,
+        at: Optional[float] = None,
+        seed: Optional[Tuple[float, float, float]] = None,
+    ) -> Optional[Tuple[float, float]]:
+        # The smoothed position, or None when the fix is an outlier. `at` is
+        # the fix time in epoch seconds, now by default. A request seen for
+        # the first time starts from `seed` (lat, lng, epoch seconds), the
+        # last known position, so even its first fix is checked.
+        at = time.time() if at is None else at
+        state = self.states.get(request_id)
+        if state is None:
+            if seed is None:
+                self.states[request_id] = KalmanState(lat, lng, at)
+                return lat, lng
+            state = self.states[request_id] = KalmanState(*seed)
+
+        # speed gate between raw fixes; the estimate may trail a moving
+        # vehicle and would make ordinary driving look like a jump
+        jump = haversine_distance(state.raw_lat, state.raw_lng, lat, lng, km=False)
+        elapsed = at - state.raw_at
+        if jump > GPS_MIN_OUTLIER_M and (
+            elapsed <= 0 or jump / elapsed > GPS_MAX_SPEED_KMH / 3.6
+        ):
+            state.rejected += 1
+            self.rejected_fixes += 1
+            if state.rejected <= GPS_MAX_REJECTED:
+                return None
+            # the mechanic really is over there, restart from this fix
+            self.states[request_id] = KalmanState(lat, lng, at)
+            return lat, lng
+
+        state.rejected = 0
+        state.update(lat, lng, at)
+        return state.position()
+
+    def drop(self, request_id: int):
+        self.states.pop(request_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "filtered_requests": len(self.states),
+            "rejected_fixes": self.rejected_fixes,
+        }
+
+
+gps_filter = GpsFilter()
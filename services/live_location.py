@@ -0,0 +1,359 @@
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import WebSocket, WebSocketDisconnect
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import ServiceRequest, async_session_maker
+from dependencies.helper import Status
+from services.distance import haversine_distance
+from services.fleet_map import fleet
+from services.location_cache import positions
+from services.location_writer import location_writer
+from services.breadcrumbs import breadcrumbs
+from services.eta import eta_estimator
+from services.geofence import GEOFENCE_RADIUS_M, geofences, is_arrival
+from services.gps_filter import gps_filter
+from services.notifications import notifications
+from services.tracking_lifecycle import end_tracking
+from services.tracking_sessions import TrackingState
+from services.webscoket_manager import (
+    CLOSE_GOING_AWAY,
+    CLOSE_NORMAL,
+    HEARTBEAT_INTERVAL,
+    IDLE_TIMEOUT,
+    SEND_TIMEOUT,
+    manager,
+)
+
+load_dotenv()
+
+# the stored point is refreshed when the mechanic moved MIN_MOVE_M meters
+# or MAX_SILENCE_S seconds passed since it was buffered for writing
+MIN_MOVE_M = 10
+MAX_SILENCE_S = 30
+
+# bounds of the sampling hints returned to mechanic clients
+SAMPLING_MIN_INTERVAL_MS = int(os.getenv("TRACKING_SAMPLING_MIN_INTERVAL_MS", "1000"))
+SAMPLING_MAX_INTERVAL_MS = int(os.getenv("TRACKING_SAMPLING_MAX_INTERVAL_MS", str(MAX_SILENCE_S * 1000)))
+SAMPLING_MIN_DISTANCE_M = float(os.getenv("TRACKING_SAMPLING_MIN_DISTANCE_M", "5"))
+SAMPLING_MAX_DISTANCE_M = float(os.getenv("TRACKING_SAMPLING_MAX_DISTANCE_M", "250"))
+
+# limits of an offline batch upload
+MAX_BATCH_FIXES = int(os.getenv("TRACKING_MAX_BATCH_FIXES", "1000"))
+MAX_CLOCK_SKEW_S = 60
+
+
+def sampling_hint(remaining_m: float, speed_kmh: float) -> dict:
+    # Sparse far from the destination, dense close to it: the client may
+    # skip fixes until it moved a quarter of the way to the arrival
+    # geofence, and is asked for the next one about when it gets there.
+    # Both shrink as the mechanic approaches, so arrival is never skipped.
+    gap = max(remaining_m - GEOFENCE_RADIUS_M, 0)
+    min_distance = min(max(gap / 4, SAMPLING_MIN_DISTANCE_M), SAMPLING_MAX_DISTANCE_M)
+
+    speed_mps = max(speed_kmh / 3.6, 0.1)
+    interval = min_distance / speed_mps * 1000
+    interval = min(max(interval, SAMPLING_MIN_INTERVAL_MS), SAMPLING_MAX_INTERVAL_MS)
+
+    return {
+        "next_update_in_ms": int(interval),
+        "min_distance_m": round(min_distance),
+    }
+
+
+async def process_location_fix(
+    state: TrackingState,
+    lat: float,
+    lng: float,
+    db: Optional[AsyncSession] = None,
+) -> dict:
+    # Shared by the PATCH endpoint and the mechanic upstream socket. Stored
+    # points go to the write-behind buffer; the DB is only written inline on
+    # arrival, without a session a short-lived one is opened for that write.
+    # While tracking goes on the result carries the sampling hints.
+    # Fixes are smoothed first, outliers are dropped without any effect.
+    now = datetime.now(timezone.utc)
+
+    smoothed = gps_filter.apply(
+        state.request_id, lat, lng, now.timestamp(), seed=_filter_seed(state)
+    )
+    if smoothed is None:
+        return {"arrived": False, "rejected": True}
+    lat, lng = smoothed
+
+    distance = haversine_distance(state.last_lat, state.last_lng, lat, lng, km=False)
+    time_passed = (now - state.last_timestamp).total_seconds()
+
+    persist = distance >= MIN_MOVE_M or time_passed >= MAX_SILENCE_S
+
+    events = geofences.evaluate(
+        state.request_id, lat, lng, now.timestamp(), center=(state.dest_lat, state.dest_lng)
+    )
+    arrived = is_arrival(events)
+
+    if persist:
+        location_writer.add(state.request_id, state.track_id, lat, lng, now)
+        breadcrumbs.add(state.request_id, lat, lng, now)
+        state.last_lat = lat
+        state.last_lng = lng
+        state.last_timestamp = now
+
+    if arrived:
+        if db is None:
+            async with async_session_maker() as session:
+                arrived = await _write_arrival(session, state)
+        else:
+            arrived = await _write_arrival(db, state)
+
+    return await _publish_position(state, lat, lng, arrived, events=events)
+
+
+def validate_fixes(fixes: List[Tuple[float, float, datetime]]) -> Optional[str]:
+    # One pass over an offline batch, returns the first problem found.
+    # Fixes must be in chronological order and not in the future.
+    if not fixes:
+        return "No fixes"
+    if len(fixes) > MAX_BATCH_FIXES:
+        return f"At most {MAX_BATCH_FIXES} fixes per batch"
+
+    latest = datetime.now(timezone.utc) + timedelta(seconds=MAX_CLOCK_SKEW_S)
+    previous = None
+    for index, (lat, lng, timestamp) in enumerate(fixes):
+        if not -90 <= lat <= 90 or not -180 <= lng <= 180:
+            return f"Fix {index}: coordinates out of range"
+        if timestamp > latest:
+            return f"Fix {index}: timestamp in the future"
+        if previous is not None and timestamp <= previous:
+            return f"Fix {index}: timestamps must be strictly increasing"
+        previous = timestamp
+    return None
+
+
+async def process_location_batch(
+    state: TrackingState,
+    fixes: List[Tuple[float, float, datetime]],
+    db: AsyncSession,
+) -> dict:
+    # Replays fixes recorded while the mechanic was offline. The storage and
+    # arrival rules of process_location_fix are applied over the sequence,
+    # by the fixes' own timestamps; the stored points go to the history in
+    # one INSERT and only the final position is broadcast. Fixes older than
+    # the last stored point and fixes after the arrival are ignored.
+    last_lat, last_lng, last_timestamp = state.last_lat, state.last_lng, state.last_timestamp
+    rows = []
+    final = None
+    arrived = False
+    accepted = 0
+    rejected = 0
+    events = []
+    seed = _filter_seed(state)
+
+    for lat, lng, timestamp in fixes:
+        if timestamp <= state.last_timestamp:
+            continue
+        smoothed = gps_filter.apply(state.request_id, lat, lng, timestamp.timestamp(), seed=seed)
+        if smoothed is None:
+            rejected += 1
+            continue
+        accepted += 1
+        lat, lng = smoothed
+        final = (lat, lng, timestamp)
+
+        fix_events = geofences.evaluate(
+            state.request_id, lat, lng, timestamp.timestamp(), center=(state.dest_lat, state.dest_lng)
+        )
+        events.extend(fix_events)
+        arrived = is_arrival(fix_events)
+        if (
+            arrived
+            or haversine_distance(last_lat, last_lng, lat, lng, km=False) >= MIN_MOVE_M
+            or (timestamp - last_timestamp).total_seconds() >= MAX_SILENCE_S
+        ):
+            rows.append(
+                {
+                    "request_id": state.request_id,
+                    "mechanic_lat": lat,
+                    "mechanic_lng": lng,
+                    "recorded_at": timestamp,
+                }
+            )
+            last_lat, last_lng, last_timestamp = lat, lng, timestamp
+        if arrived:
+            break
+
+    # older than the last stored point or after the arrival
+    skipped = len(fixes) - accepted - rejected
+
+    if final is None:
+        return {"arrived": False, "accepted": 0, "stored": 0, "rejected": rejected, "skipped": skipped}
+
+    await breadcrumbs.write(rows, db)
+    if rows:
+        location_writer.add(state.request_id, state.track_id, last_lat, last_lng, last_timestamp)
+        state.last_lat = last_lat
+        state.last_lng = last_lng
+        state.last_timestamp = last_timestamp
+
+    if arrived:
+        arrived = await _write_arrival(db, state)
+    else:
+        await location_writer.flush(state.request_id, session=db)
+        await db.commit()
+
+    # the speed window holds live fixes only, replayed ones would skew it
+    eta_estimator.drop(state.request_id)
+
+    lat, lng, timestamp = final
+    result = await _publish_position(state, lat, lng, arrived, timestamp, events)
+    return {
+        **result,
+        "accepted": accepted,
+        "stored": len(rows),
+        "rejected": rejected,
+        "skipped": skipped,
+    }
+
+
+def _filter_seed(state: TrackingState) -> tuple:
+    return state.last_lat, state.last_lng, state.last_timestamp.timestamp()
+
+
+async def _publish_position(
+    state: TrackingState,
+    lat: float,
+    lng: float,
+    arrived: bool,
+    timestamp: Optional[datetime] = None,
+    events: Optional[List[str]] = None,
+) -> dict:
+    if state.status not in (Status.accepted, Status.arrived):
+        return {"arrived": False}
+
+    eta = eta_estimator.update(state.request_id, lat, lng, state.dest_lat, state.dest_lng)
+
+    frame = {
+        "request_id": state.request_id,
+        "lat": lat,
+        "lng": lng,
+        "arrived" : arrived ,
+        "eta_seconds": 0 if arrived else eta["eta_seconds"],
+        "remaining_km": eta["remaining_km"],
+        "timestamp": (timestamp or datetime.now()).isoformat()
+    }
+    if events:
+        frame["geofence"] = events
+
+    fleet.update("mechanic", state.mechanic_id, lat, lng)
+
+    if arrived:
+        fleet.update("request", state.request_id, status=Status.arrived)
+        await notifications.notify_status(
+            state.request_id, Status.arrived, state.user_id, state.mechanic_id
+        )
+        await end_tracking(
+            state.request_id,
+            event=frame,
+            upstream_message={"type": "arrived", "request_id": state.request_id},
+        )
+    else:
+        positions.set(state.request_id, frame)
+        await manager.publish_location(state.request_id, frame)
+        return {
+            "arrived": False,
+            **sampling_hint(eta["remaining_km"] * 1000, eta["speed_kmh"]),
+        }
+
+    return {"arrived": arrived}
+
+
+async def _write_arrival(db: AsyncSession, state: TrackingState) -> bool:
+    # the buffered point is written in the same transaction as the status change
+    await location_writer.flush(state.request_id, session=db)
+
+    # conditional so a request canceled meanwhile is never flipped to Arrived
+    result = await db.execute(
+        update(ServiceRequest)
+        .where(
+            ServiceRequest.request_id == state.request_id,
+            ServiceRequest.status == Status.accepted,
+        )
+        .values(status=Status.arrived)
+    )
+    await db.commit()
+
+    if not result.rowcount:
+        # ended meanwhile, possibly by another worker
+        await end_tracking(state.request_id)
+        state.status = None
+        return False
+    state.status = Status.arrived
+    return True
+
+
+async def stream_location_fixes(websocket: WebSocket, state: TrackingState):
+    # Receive loop of the mechanic upstream socket: one JSON frame per fix,
+    # {"lat": .., "lng": ..}. Nothing is sent back per fix, only pongs,
+    # errors and sampling hints when they change. The arrival notice and the
+    # close come from end_tracking, whichever path ended the request.
+    last_seen = time.monotonic()
+    last_hint = None
+    await manager.attach_upstream(state.request_id, websocket)
+    try:
+        while state.status == Status.accepted:
+            try:
+                message = await asyncio.wait_for(
+                    websocket.receive(), timeout=HEARTBEAT_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                if time.monotonic() - last_seen >= IDLE_TIMEOUT:
+                    await websocket.close(code=CLOSE_GOING_AWAY, reason="idle timeout")
+                    return
+                await _send(websocket, {"type": "ping"})
+                continue
+
+            if message["type"] == "websocket.disconnect":
+                return
+            last_seen = time.monotonic()
+
+            try:
+                data = json.loads(message.get("text") or "")
+            except ValueError:
+                await _send(websocket, {"type": "error", "detail": "invalid JSON"})
+                continue
+            if not isinstance(data, dict):
+                continue
+
+            if data.get("type") == "ping":
+                await _send(websocket, {"type": "pong"})
+                continue
+
+            try:
+                lat = float(data["lat"])
+                lng = float(data["lng"])
+            except (KeyError, TypeError, ValueError):
+                await _send(websocket, {"type": "error", "detail": "lat and lng are required"})
+                continue
+
+            result = await process_location_fix(state, lat, lng)
+            if "min_distance_m" in result:
+                hint = (result["next_update_in_ms"], result["min_distance_m"])
+                if hint != last_hint:
+                    last_hint = hint
+                    await _send(websocket, {"type": "hint", **result})
+
+        await websocket.close(code=CLOSE_NORMAL, reason="tracking finished")
+    except (WebSocketDisconnect, RuntimeError, asyncio.TimeoutError):
+        pass
+    finally:
+        manager.detach_upstream(state.request_id, websocket)
+
+
+async def _send(websocket: WebSocket, data: dict):
+    await asyncio.wait_for(websocket.send_json(data), timeout=SEND_TIMEOUT)
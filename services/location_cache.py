@@ -0,0 +1,91 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import LocationTracking
+
+
+MAX_CACHED_POSITIONS = int(os.getenv("TRACKING_MAX_CACHED_POSITIONS", "10000"))
+# seconds a request without a stored position is remembered as such, so
+# reconnects to it don't all go to the DB
+MISSING_POSITION_TTL = float(os.getenv("TRACKING_MISSING_POSITION_TTL", "5"))
+
+
+class LastKnownPositionCache:
+    def __init__(self, max_entries: int = MAX_CACHED_POSITIONS):
+        # request_id -> last location frame, least recently used first
+        self.positions: "OrderedDict[int, dict]" = OrderedDict()
+        self.max_entries = max_entries
+        # request_id -> monotonic expiry of a "no position" answer, oldest first
+        self.missing: "OrderedDict[int, float]" = OrderedDict()
+
+    def get(self, request_id: int) -> Optional[dict]:
+        frame = self.positions.get(request_id)
+        if frame is not None:
+            self.positions.move_to_end(request_id)
+        return frame
+
+    def set(self, request_id: int, frame: dict):
+        self.missing.pop(request_id, None)
+        self.positions[request_id] = frame
+        self.positions.move_to_end(request_id)
+        while len(self.positions) > self.max_entries:
+            self.positions.popitem(last=False)
+
+    def drop(self, request_id: int):
+        self.positions.pop(request_id, None)
+        self.missing.pop(request_id, None)
+
+    def is_missing(self, request_id: int) -> bool:
+        expires = self.missing.get(request_id)
+        if expires is None:
+            return False
+        if expires <= time.monotonic():
+            del self.missing[request_id]
+            return False
+        return True
+
+    def set_missing(self, request_id: int):
+        now = time.monotonic()
+        # all entries share the TTL, so the expired ones are at the front
+        while self.missing and next(iter(self.missing.values())) <= now:
+            self.missing.popitem(last=False)
+        self.missing[request_id] = now + MISSING_POSITION_TTL
+        self.missing.move_to_end(request_id)
+        while len(self.missing) > self.max_entries:
+            self.missing.popitem(last=False)
+
+    async def get_or_load(self, request_id: int, session: AsyncSession) -> Optional[dict]:
+        frame = self.get(request_id)
+        if frame is not None:
+            return frame
+        if self.is_missing(request_id):
+            return None
+
+        result = await session.execute(
+            select(LocationTracking)
+            .where(LocationTracking.request_id == request_id)
+            .order_by(LocationTracking.timestamp.desc())
+            .limit(1)
+        )
+        tracking = result.scalar_one_or_none()
+        if not tracking or tracking.mechanic_lat is None or tracking.mechanic_lng is None:
+            self.set_missing(request_id)
+            return None
+
+        frame = {
+            "request_id": request_id,
+            "lat": float(tracking.mechanic_lat),
+            "lng": float(tracking.mechanic_lng),
+            "arrived": False,
+            "timestamp": tracking.timestamp.isoformat() if tracking.timestamp else None,
+        }
+        self.set(request_id, frame)
+        return frame
+
+
+positions = LastKnownPositionCache()
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import LocationTracking, async_session_maker
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# seconds between bulk writes of the buffered live locations
+FLUSH_INTERVAL = float(os.getenv("TRACKING_FLUSH_INTERVAL", "5"))
+
+
+class LocationWriteBuffer:
+    # Write-behind buffer for location_tracking. Only the newest point per
+    # request is kept, so the number of rows written per flush is bounded by
+    # the number of active requests, not by how often mechanics send fixes.
+
+    def __init__(self):
+        # request_id -> row for the bulk UPDATE of location_tracking
+        self.pending: Dict[int, dict] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.flushed_rows = 0
+
+    def add(self, request_id: int, track_id: int, lat: float, lng: float, timestamp: datetime):
+        self.pending[request_id] = {
+            "track_id": track_id,
+            "mechanic_lat": lat,
+            "mechanic_lng": lng,
+            "timestamp": timestamp,
+        }
+
+    async def flush(self, request_id: Optional[int] = None, session: Optional[AsyncSession] = None):
+        # Flush everything, or only one request (used on status transitions).
+        # With a session the rows join the caller's transaction and the caller
+        # commits; otherwise a short-lived session is used.
+        if request_id is None:
+            rows = dict(self.pending)
+            self.pending.clear()
+        elif request_id in self.pending:
+            rows = {request_id: self.pending.pop(request_id)}
+        else:
+            return
+
+        if not rows:
+            return
+
+        try:
+            if session is not None:
+                await session.execute(update(LocationTracking), list(rows.values()))
+            else:
+                async with async_session_maker() as own_session:
+                    await own_session.execute(update(LocationTracking), list(rows.values()))
+                    await own_session.commit()
+        except Exception:
+            # keep the points for the next flush unless a newer one arrived meanwhile
+            for key, row in rows.items():
+                self.pending.setdefault(key, row)
+            raise
+
+        self.flushed_rows += len(rows)
+
+    def discard(self, request_id: int):
+        self.pending.pop(request_id, None)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("live location flush failed")
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self.pending),
+            "flushed_rows": self.flushed_rows,
+        }
+
+
+location_writer = LocationWriteBuffer()
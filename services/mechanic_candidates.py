@@ -0,0 +1,104 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from services.fleet_map import fleet
+from services.skill_mask import has_skills
+
+
+EARTH_RADIUS_KM = 6371.0
+
+
+class MechanicCandidates:
+    # Columnar copy of the mechanics in the fleet map: one row per mechanic
+    # in numpy arrays, kept in sync through the FleetMap listeners. Picking
+    # the available mechanics with a skill within a radius is a bitwise AND
+    # and a haversine over whole arrays instead of a loop over entities.
+
+    def __init__(self, capacity: int = 1024):
+        self.keys: List[str] = []
+        # mechanic key -> row
+        self.rows: Dict[str, int] = {}
+        self.lat = np.zeros(capacity)
+        self.lng = np.zeros(capacity)
+        self.mask = np.zeros(capacity, dtype=np.int64)
+        self.available = np.zeros(capacity, dtype=bool)
+        fleet.listeners.append(self.on_entity_change)
+
+    def on_entity_change(self, key: str, entity: Optional[dict], old: Optional[Tuple[float, float]]):
+        if not key.startswith("mechanic:"):
+            return
+        if entity is None:
+            self.remove(key)
+        else:
+            self.upsert(key, entity)
+
+    def upsert(self, key: str, entity: dict):
+        row = self.rows.get(key)
+        if row is None:
+            row = len(self.keys)
+            if row == len(self.lat):
+                self._grow()
+            self.keys.append(key)
+            self.rows[key] = row
+        self.lat[row] = entity["lat"]
+        self.lng[row] = entity["lng"]
+        self.mask[row] = entity.get("skill_mask") or 0
+        self.available[row] = entity.get("status") == "available"
+
+    def remove(self, key: str):
+        # the last row moves into the hole, rows stay contiguous
+        row = self.rows.pop(key, None)
+        if row is None:
+            return
+        last = len(self.keys) - 1
+        if row != last:
+            moved = self.keys[last]
+            self.keys[row] = moved
+            self.rows[moved] = row
+            for column in (self.lat, self.lng, self.mask, self.available):
+                column[row] = column[last]
+        self.keys.pop()
+
+    def select(self, lat: float, lng: float, radius_km: float, required_mask: int) -> List[Tuple[str, float]]:
+        # (mechanic key, distance in km) of the available mechanics having
+        # every skill of required_mask within radius_km, nearest first
+        count = len(self.keys)
+        if count == 0:
+            return []
+
+        matches = self.available[:count] & has_skills(self.mask[:count], required_mask)
+        rows = np.flatnonzero(matches)
+        if rows.size == 0:
+            return []
+
+        # rounded like services.distance.haversine_distance, so the radius
+        # check agrees with the per-entity one
+        distances = np.round(haversine_km(lat, lng, self.lat[rows], self.lng[rows]), 2)
+        within = distances <= radius_km
+        rows, distances = rows[within], distances[within]
+        order = np.argsort(distances, kind="stable")
+        return [(self.keys[rows[index]], float(distances[index])) for index in order]
+
+    def _grow(self):
+        size = len(self.lat) * 2
+        self.lat = np.resize(self.lat, size)
+        self.lng = np.resize(self.lng, size)
+        self.mask = np.resize(self.mask, size)
+        self.available = np.resize(self.available, size)
+
+    def stats(self) -> dict:
+        return {
+            "mechanics": len(self.keys),
+            "capacity": len(self.lat),
+        }
+
+
+def haversine_km(lat: float, lng: float, lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+    lat1, lng1 = np.radians(lat), np.radians(lng)
+    lat2, lng2 = np.radians(lats), np.radians(lngs)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+candidates = MechanicCandidates()
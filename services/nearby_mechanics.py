@@ -0,0 +1,209 @@
+import asyncio
+import json
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from services.distance import haversine_distance
+from services.fleet_map import FLEET_BATCH_INTERVAL, FLEET_CELL_DEG, fleet
+from services.mechanic_candidates import candidates
+from services.skill_mask import skill_bit
+from services.spatial_index import GridIndex, bbox_around
+from services.webscoket_manager import (
+    CLOSE_GOING_AWAY,
+    CLOSE_NORMAL,
+    CLOSE_TRY_AGAIN_LATER,
+    HEARTBEAT_INTERVAL,
+    IDLE_TIMEOUT,
+    SEND_TIMEOUT,
+)
+
+
+NEARBY_DEFAULT_RADIUS_KM = float(os.getenv("NEARBY_DEFAULT_RADIUS_KM", "10"))
+NEARBY_MAX_RADIUS_KM = float(os.getenv("NEARBY_MAX_RADIUS_KM", "50"))
+NEARBY_MAX_WATCHERS = int(os.getenv("NEARBY_MAX_WATCHERS", "1000"))
+
+
+class NearbyWatcher:
+    def __init__(self, websocket: WebSocket, request_id: int, lat: float, lng: float, radius_km: float, skill: str):
+        self.websocket = websocket
+        self.request_id = request_id
+        self.lat = lat
+        self.lng = lng
+        self.radius_km = radius_km
+        self.skill = skill
+        self.skill_mask = skill_bit(skill)
+        self.cells = []
+        # mechanic keys the client currently shows
+        self.visible: set = set()
+        # mechanic key -> newest entity since the last batch, None once removed
+        self.pending: Dict[str, Optional[dict]] = {}
+        self.last_seen = time.monotonic()
+
+    def distance_km(self, entity: dict) -> float:
+        return haversine_distance(self.lat, self.lng, entity["lat"], entity["lng"])
+
+    def matches(self, entity: Optional[dict]) -> bool:
+        return (
+            entity is not None
+            and entity.get("status") == "available"
+            and self.skill_mask != 0
+            and (entity.get("skill_mask") or 0) & self.skill_mask == self.skill_mask
+            and self.distance_km(entity) <= self.radius_km
+        )
+
+    def item(self, entity: dict) -> dict:
+        return {
+            "id": entity["id"],
+            "name": entity.get("name"),
+            "lat": entity["lat"],
+            "lng": entity["lng"],
+            "distance_km": self.distance_km(entity),
+        }
+
+
+class NearbyMechanicsFeed:
+    # Live list of the available mechanics with the right skill around a
+    # pending request. Watchers are registered in the grid cells their
+    # radius covers and are fed by the FleetMap entity changes, so a
+    # mechanic update only visits the watchers around it and nothing is
+    # ranked again.
+
+    def __init__(self):
+        self.watcher_index = GridIndex(FLEET_CELL_DEG)
+        self.watchers: Dict[WebSocket, NearbyWatcher] = {}
+        self.flush_task: Optional[asyncio.Task] = None
+        fleet.listeners.append(self.on_entity_change)
+
+    def on_entity_change(self, key: str, entity: Optional[dict], old: Optional[Tuple[float, float]]):
+        if not self.watchers or not key.startswith("mechanic:"):
+            return
+
+        cells = set()
+        if entity is not None:
+            cells.add(self.watcher_index.cell_of(entity["lat"], entity["lng"]))
+        if old is not None:
+            cells.add(self.watcher_index.cell_of(*old))
+
+        for cell in cells:
+            for websocket in self.watcher_index.members(cell):
+                self.watchers[websocket].pending[key] = entity
+
+    async def connect(self, watcher: NearbyWatcher) -> bool:
+        websocket = watcher.websocket
+        await websocket.accept()
+        if len(self.watchers) >= NEARBY_MAX_WATCHERS:
+            await websocket.close(code=CLOSE_TRY_AGAIN_LATER, reason="too many watchers")
+            return False
+
+        watcher.cells = self.watcher_index.cells_covering(
+            *bbox_around(watcher.lat, watcher.lng, watcher.radius_km)
+        )
+        self.watcher_index.add(websocket, watcher.cells)
+        self.watchers[websocket] = watcher
+
+        items = []
+        if watcher.skill_mask:
+            # nearest first, straight from the candidate arrays
+            selected = candidates.select(watcher.lat, watcher.lng, watcher.radius_km, watcher.skill_mask)
+            for key, _ in selected:
+                watcher.visible.add(key)
+                items.append(watcher.item(fleet.entities[key]))
+        await self._send(watcher, {"type": "snapshot", "items": items})
+
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self._flush_loop())
+        return True
+
+    def disconnect(self, websocket: WebSocket):
+        watcher = self.watchers.pop(websocket, None)
+        if watcher is not None:
+            self.watcher_index.discard(websocket, watcher.cells)
+
+    async def close_request(self, request_id: int, reason: str = "request no longer pending"):
+        # the request was accepted, canceled or deleted
+        for watcher in [item for item in self.watchers.values() if item.request_id == request_id]:
+            self.disconnect(watcher.websocket)
+            try:
+                await watcher.websocket.close(code=CLOSE_NORMAL, reason=reason)
+            except Exception:
+                pass
+
+    async def listen(self, websocket: WebSocket):
+        watcher = self.watchers[websocket]
+        try:
+            while websocket in self.watchers:
+                try:
+                    message = await asyncio.wait_for(
+                        websocket.receive(), timeout=HEARTBEAT_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    if time.monotonic() - watcher.last_seen >= IDLE_TIMEOUT:
+                        await websocket.close(code=CLOSE_GOING_AWAY, reason="idle timeout")
+                        return
+                    await self._send(watcher, {"type": "ping"})
+                    continue
+
+                if message["type"] == "websocket.disconnect":
+                    break
+                watcher.last_seen = time.monotonic()
+
+                try:
+                    data = json.loads(message.get("text") or "")
+                except ValueError:
+                    continue
+                if isinstance(data, dict) and data.get("type") == "ping":
+                    await self._send(watcher, {"type": "pong"})
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+        finally:
+            self.disconnect(websocket)
+
+    def deltas(self, watcher: NearbyWatcher) -> list:
+        # pending changes against what the client shows: add, move or remove
+        items = []
+        for key, entity in watcher.pending.items():
+            if watcher.matches(entity):
+                op = "move" if key in watcher.visible else "add"
+                watcher.visible.add(key)
+                items.append({"op": op, **watcher.item(entity)})
+            elif key in watcher.visible:
+                watcher.visible.discard(key)
+                items.append({"op": "remove", "id": key.split(":", 1)[1]})
+        watcher.pending.clear()
+        return items
+
+    async def _send(self, watcher: NearbyWatcher, data: dict):
+        try:
+            await asyncio.wait_for(
+                watcher.websocket.send_text(json.dumps(data, default=str)),
+                timeout=SEND_TIMEOUT,
+            )
+        except Exception:
+            self.disconnect(watcher.websocket)
+
+    async def _flush_loop(self):
+        while self.watchers:
+            await asyncio.sleep(FLEET_BATCH_INTERVAL)
+            for watcher in list(self.watchers.values()):
+                if not watcher.pending:
+                    continue
+                items = self.deltas(watcher)
+                if items:
+                    await self._send(watcher, {"type": "deltas", "items": items})
+
+    def stats(self) -> dict:
+        return {
+            "watchers": len(self.watchers),
+        }
+
+
+def clamp_radius(radius_km: Optional[float]) -> float:
+    if not radius_km or radius_km <= 0:
+        return NEARBY_DEFAULT_RADIUS_KM
+    return min(radius_km, NEARBY_MAX_RADIUS_KM)
+
+
+nearby = NearbyMechanicsFeed()
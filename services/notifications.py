@@ -0,0 +1,240 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional
+
+from dotenv import load_dotenv
+from fastapi import WebSocket, WebSocketDisconnect
+from sqlalchemy import select
+
+from app.db.models import ServiceRequest, async_session_maker
+from dependencies.helper import Status
+from services.location_cache import positions
+from services.webscoket_manager import (
+    CLOSE_GOING_AWAY,
+    CLOSE_TRY_AGAIN_LATER,
+    HEARTBEAT_INTERVAL,
+    IDLE_TIMEOUT,
+    SEND_TIMEOUT,
+    manager,
+)
+
+load_dotenv()
+
+NOTIFY_MAX_SOCKETS_PER_USER = int(os.getenv("NOTIFY_MAX_SOCKETS_PER_USER", "5"))
+# tracking channels one notification socket may subscribe to at once
+NOTIFY_MAX_SUBSCRIPTIONS = int(os.getenv("NOTIFY_MAX_SUBSCRIPTIONS", "5"))
+
+
+class TrackingSubscription:
+    # Stands in for a tracking socket in the ConnectionManager channel of a
+    # request, so coalescing, caps and teardown apply unchanged. Frames are
+    # forwarded to the notification socket wrapped as
+    # {"type": "tracking", "request_id": .., "data": <frame>}; the JSON of
+    # the frame is spliced in as is, not encoded again.
+
+    def __init__(self, hub: "NotificationHub", websocket: WebSocket, request_id: int):
+        self.hub = hub
+        self.websocket = websocket
+        self.request_id = request_id
+        self.prefix = f'{{"type": "tracking", "request_id": {request_id}, "data": '
+
+    async def accept(self, subprotocol: Optional[str] = None):
+        pass
+
+    async def send_text(self, text: str):
+        await self.websocket.send_text(self.prefix + text + "}")
+
+    async def send_bytes(self, frame: bytes):
+        # subscriptions never negotiate the binary subprotocol
+        raise RuntimeError("binary frames are not multiplexed")
+
+    async def send_json(self, data: dict):
+        await self.send_text(json.dumps(data, default=str))
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        # the tracking channel ended, the notification socket stays open
+        if self.hub.forget(self.websocket, self.request_id):
+            try:
+                await self.hub.send(
+                    self.websocket,
+                    {"type": "tracking_closed", "request_id": self.request_id, "reason": reason},
+                )
+            except Exception:
+                pass
+
+
+class NotificationHub:
+    # One socket per signed-in client carrying the status events of all the
+    # user's or mechanic's requests, plus any tracking channels it
+    # subscribed to. Replaces polling the request endpoints.
+
+    def __init__(self):
+        # user id -> open notification sockets
+        self.sockets: Dict[uuid.UUID, List[WebSocket]] = {}
+        # websocket -> user id it belongs to
+        self.owners: Dict[WebSocket, uuid.UUID] = {}
+        # websocket -> request_id -> tracking subscription
+        self.subscriptions: Dict[WebSocket, Dict[int, TrackingSubscription]] = {}
+        self.sent_events = 0
+
+    async def connect(self, user_id: uuid.UUID, websocket: WebSocket):
+        await websocket.accept()
+        sockets = self.sockets.setdefault(user_id, [])
+        if len(sockets) >= NOTIFY_MAX_SOCKETS_PER_USER:
+            oldest = sockets[0]
+            await self.disconnect(oldest)
+            try:
+                await oldest.close(code=CLOSE_TRY_AGAIN_LATER, reason="connection limit reached")
+            except Exception:
+                pass
+            sockets = self.sockets.setdefault(user_id, [])
+        sockets.append(websocket)
+        self.owners[websocket] = user_id
+        self.subscriptions[websocket] = {}
+
+    async def disconnect(self, websocket: WebSocket):
+        user_id = self.owners.pop(websocket, None)
+        if user_id is None:
+            return
+        sockets = self.sockets.get(user_id, [])
+        if websocket in sockets:
+            sockets.remove(websocket)
+        if not sockets:
+            self.sockets.pop(user_id, None)
+        for subscription in self.subscriptions.pop(websocket, {}).values():
+            manager.disconnect(subscription.request_id, subscription)
+
+    def forget(self, websocket: WebSocket, request_id: int) -> bool:
+        subscription = self.subscriptions.get(websocket, {}).pop(request_id, None)
+        if subscription is None:
+            return False
+        manager.disconnect(request_id, subscription)
+        return True
+
+    async def send(self, websocket: WebSocket, data: dict):
+        await asyncio.wait_for(websocket.send_json(data), timeout=SEND_TIMEOUT)
+
+    async def notify(self, user_ids: Iterable[Optional[uuid.UUID]], data: dict):
+        # Pushes an event to every socket of the given users; the text is
+        # encoded once. Sockets that fail are dropped.
+        text = None
+        for user_id in set(user_ids):
+            for websocket in list(self.sockets.get(user_id, [])):
+                if text is None:
+                    text = json.dumps(data, default=str)
+                try:
+                    await asyncio.wait_for(websocket.send_text(text), timeout=SEND_TIMEOUT)
+                    self.sent_events += 1
+                except Exception:
+                    await self.disconnect(websocket)
+
+    async def notify_status(
+        self,
+        request_id: int,
+        status: str,
+        user_id: Optional[uuid.UUID],
+        mechanic_id: Optional[uuid.UUID] = None,
+    ):
+        await self.notify(
+            (user_id, mechanic_id),
+            {"type": "status", "request_id": request_id, "status": status},
+        )
+
+    async def subscribe(self, websocket: WebSocket, request_id: int) -> Optional[str]:
+        # Attaches the socket to the tracking channel of one of the user's
+        # requests. Returns an error message or None.
+        subscriptions = self.subscriptions.get(websocket)
+        if subscriptions is None:
+            return "not connected"
+        if request_id in subscriptions:
+            return None
+        if len(subscriptions) >= NOTIFY_MAX_SUBSCRIPTIONS:
+            return "too many subscriptions"
+
+        user_id = self.owners[websocket]
+        async with async_session_maker() as session:
+            result = await session.execute(
+                select(ServiceRequest.user_id, ServiceRequest.mechanic_id, ServiceRequest.status).where(
+                    ServiceRequest.request_id == request_id
+                )
+            )
+            request = result.one_or_none()
+            if not request or user_id not in (request.user_id, request.mechanic_id):
+                return "request not found"
+            if request.status != Status.accepted:
+                return "tracking not active"
+            snapshot = await positions.get_or_load(request_id, session)
+
+        subscription = TrackingSubscription(self, websocket, request_id)
+        subscriptions[request_id] = subscription
+        await manager.connect(request_id, subscription)
+        if snapshot:
+            await manager.send_to(subscription, {**snapshot, "snapshot": True})
+        return None
+
+    async def listen(self, websocket: WebSocket):
+        # Client messages: {"type": "ping"},
+        # {"type": "subscribe", "request_id": 1}, {"type": "unsubscribe", "request_id": 1}
+        last_seen = time.monotonic()
+        try:
+            while websocket in self.owners:
+                try:
+                    message = await asyncio.wait_for(
+                        websocket.receive(), timeout=HEARTBEAT_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    if time.monotonic() - last_seen >= IDLE_TIMEOUT:
+                        await websocket.close(code=CLOSE_GOING_AWAY, reason="idle timeout")
+                        return
+                    await self.send(websocket, {"type": "ping"})
+                    continue
+
+                if message["type"] == "websocket.disconnect":
+                    return
+                last_seen = time.monotonic()
+                for subscription in self.subscriptions.get(websocket, {}).values():
+                    manager.last_seen[subscription] = last_seen
+
+                try:
+                    data = json.loads(message.get("text") or "")
+                except ValueError:
+                    continue
+                if not isinstance(data, dict):
+                    continue
+
+                kind = data.get("type")
+                if kind == "ping":
+                    await self.send(websocket, {"type": "pong"})
+                elif kind in ("subscribe", "unsubscribe"):
+                    try:
+                        request_id = int(data["request_id"])
+                    except (KeyError, TypeError, ValueError):
+                        await self.send(websocket, {"type": "error", "detail": "request_id is required"})
+                        continue
+                    if kind == "unsubscribe":
+                        self.forget(websocket, request_id)
+                        continue
+                    error = await self.subscribe(websocket, request_id)
+                    if error:
+                        await self.send(
+                            websocket,
+                            {"type": "error", "request_id": request_id, "detail": error},
+                        )
+        except (WebSocketDisconnect, RuntimeError, asyncio.TimeoutError):
+            pass
+        finally:
+            await self.disconnect(websocket)
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self.sockets),
+            "sockets": len(self.owners),
+            "subscriptions": sum(len(items) for items in self.subscriptions.values()),
+            "sent_events": self.sent_events,
+        }
+
+
+notifications = NotificationHub()
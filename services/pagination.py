@@ -0,0 +1,53 @@
+import base64
+from datetime import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import tuple_
+
+
+# Keyset pagination over (created_at, request_id), newest first. The cursor
+# is the key of the last row of a page; the next page starts right after it,
+# so a page costs the same whatever its depth.
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(created_at: datetime, request_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{request_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    # ValueError on anything that isn't a cursor from encode_cursor
+    try:
+        created_at, request_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(request_id)
+    except Exception:
+        raise ValueError("invalid cursor")
+
+
+def valid_cursor(cursor: str) -> bool:
+    try:
+        decode_cursor(cursor)
+    except ValueError:
+        return False
+    return True
+
+
+def after_cursor(stmt, created_column, id_column, cursor: Optional[str]):
+    # orders newest first and skips everything up to the cursor
+    stmt = stmt.order_by(created_column.desc(), id_column.desc())
+    if cursor is None:
+        return stmt
+    created_at, request_id = decode_cursor(cursor)
+    # row comparison, matched directly by an index on (created_at, request_id)
+    return stmt.where(tuple_(created_column, id_column) < tuple_(created_at, request_id))
+
+
+def next_cursor(rows, limit: int, created_of, id_of) -> Optional[str]:
+    # rows were fetched with limit + 1, the extra row only tells a next page exists
+    if len(rows) <= limit:
+        return None
+    last = rows[limit - 1]
+    return encode_cursor(created_of(last), id_of(last))
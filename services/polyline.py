@@ -0,0 +1,72 @@
+from typing import Iterable, Iterator, List, Sequence, Tuple
+
+
+# Encoded polyline format (the one used by Google Maps): every value is the
+# zigzag-encoded delta to the previous one, written in 5-bit chunks as
+# printable ASCII. Coordinates use 6 decimals, the precision of the
+# Numeric(9, 6) columns they come from, so a round trip is lossless.
+POLYLINE_PRECISION = 6
+
+
+def _encode_value(value: int, out: List[str]):
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        out.append(chr((0x20 | (value & 0x1F)) + 63))
+        value >>= 5
+    out.append(chr(value + 63))
+
+
+def encode_deltas(values: Iterable[int]) -> str:
+    out: List[str] = []
+    previous = 0
+    for value in values:
+        _encode_value(value - previous, out)
+        previous = value
+    return "".join(out)
+
+
+def _decode_values(encoded: str) -> Iterator[int]:
+    index = 0
+    while index < len(encoded):
+        result, shift = 0, 0
+        while True:
+            chunk = ord(encoded[index]) - 63
+            index += 1
+            result |= (chunk & 0x1F) << shift
+            shift += 5
+            if chunk < 0x20:
+                break
+        yield ~(result >> 1) if result & 1 else result >> 1
+
+
+def decode_deltas(encoded: str) -> List[int]:
+    values = []
+    current = 0
+    for delta in _decode_values(encoded):
+        current += delta
+        values.append(current)
+    return values
+
+
+def encode_polyline(points: Sequence[Tuple[float, float]], precision: int = POLYLINE_PRECISION) -> str:
+    factor = 10 ** precision
+    out: List[str] = []
+    previous_lat = previous_lng = 0
+    for lat, lng in points:
+        lat, lng = round(float(lat) * factor), round(float(lng) * factor)
+        _encode_value(lat - previous_lat, out)
+        _encode_value(lng - previous_lng, out)
+        previous_lat, previous_lng = lat, lng
+    return "".join(out)
+
+
+def decode_polyline(encoded: str, precision: int = POLYLINE_PRECISION) -> List[Tuple[float, float]]:
+    factor = 10 ** precision
+    points = []
+    lat = lng = 0
+    deltas = _decode_values(encoded)
+    for lat_delta, lng_delta in zip(deltas, deltas):
+        lat += lat_delta
+        lng += lng_delta
+        points.append((lat / factor, lng / factor))
+    return points
@@ -0,0 +1,32 @@
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+from dependencies.helper import SkillName
+
+
+# One bit per SkillName, in declaration order. The positions are stored in
+# users.skill_mask, so new skills go at the end of the enum and existing
+# members are never reordered.
+SKILL_BITS: Dict[str, int] = {skill.value: 1 << index for index, skill in enumerate(SkillName)}
+
+
+def skill_bit(name: str) -> int:
+    # 0 for skill names outside SkillName, they never match
+    return SKILL_BITS.get(getattr(name, "value", name), 0)
+
+
+def skill_mask(names: Iterable[str]) -> int:
+    mask = 0
+    for name in names:
+        mask |= skill_bit(name)
+    return mask
+
+
+def mask_skills(mask: int) -> List[str]:
+    return sorted(name for name, bit in SKILL_BITS.items() if (mask or 0) & bit)
+
+
+def has_skills(masks: np.ndarray, required: int) -> np.ndarray:
+    # element-wise: every bit of `required` is set in the mask
+    return np.bitwise_and(masks, required) == required
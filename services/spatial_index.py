@@ -0,0 +1,59 @@
+import math
+from typing import Dict, Hashable, Iterable, List, Set, Tuple
+
+
+Cell = Tuple[int, int]
+
+
+class GridIndex:
+    # Uniform lat/lng grid. Points live in one cell, areas (viewports, radii)
+    # are registered in every cell they overlap, so a point update only has
+    # to look at the members of its own cell.
+
+    def __init__(self, cell_deg: float):
+        self.cell_deg = cell_deg
+        self.cells: Dict[Cell, Set[Hashable]] = {}
+
+    def cell_of(self, lat: float, lng: float) -> Cell:
+        return (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+
+    def cells_covering(
+        self, min_lat: float, min_lng: float, max_lat: float, max_lng: float
+    ) -> List[Cell]:
+        low_lat, low_lng = self.cell_of(min_lat, min_lng)
+        high_lat, high_lng = self.cell_of(max_lat, max_lng)
+        return [
+            (cell_lat, cell_lng)
+            for cell_lat in range(low_lat, high_lat + 1)
+            for cell_lng in range(low_lng, high_lng + 1)
+        ]
+
+    def count_cells(
+        self, min_lat: float, min_lng: float, max_lat: float, max_lng: float
+    ) -> int:
+        low_lat, low_lng = self.cell_of(min_lat, min_lng)
+        high_lat, high_lng = self.cell_of(max_lat, max_lng)
+        return (high_lat - low_lat + 1) * (high_lng - low_lng + 1)
+
+    def add(self, key: Hashable, cells: Iterable[Cell]):
+        for cell in cells:
+            self.cells.setdefault(cell, set()).add(key)
+
+    def discard(self, key: Hashable, cells: Iterable[Cell]):
+        for cell in cells:
+            members = self.cells.get(cell)
+            if members is None:
+                continue
+            members.discard(key)
+            if not members:
+                del self.cells[cell]
+
+    def members(self, cell: Cell) -> Set[Hashable]:
+        return self.cells.get(cell, set())
+
+
+def bbox_around(lat: float, lng: float, radius_km: float) -> Tuple[float, float, float, float]:
+    # lat/lng box that contains the circle of radius_km around the point
+    dlat = radius_km / 111.32
+    dlng = radius_km / (111.32 * max(math.cos(math.radians(lat)), 0.01))
+    return lat - dlat, lng - dlng, lat + dlat, lng + dlng
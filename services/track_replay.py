@@ -0,0 +1,83 @@
+import json
+import math
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import func, or_, select
+
+from app.db.models import LocationBreadcrumb, LocationTrackArchive, async_session_maker
+from services.breadcrumbs import decode_archive
+
+
+# rows fetched per round trip from the server-side cursor
+REPLAY_FETCH_SIZE = 1000
+
+CSV_HEADER = "lat,lng,timestamp\n"
+
+
+def format_point(lat, lng, recorded_at, fmt: str) -> str:
+    timestamp = recorded_at.isoformat() if recorded_at is not None else ""
+    if fmt == "csv":
+        return f"{float(lat)},{float(lng)},{timestamp}\n"
+    return json.dumps({"lat": float(lat), "lng": float(lng), "timestamp": timestamp}) + "\n"
+
+
+def sample_step(total: int, max_points: Optional[int]) -> int:
+    # every step-th point from the first one plus the last point, at most
+    # max_points of them
+    if not max_points or not total:
+        return 1
+    return max(math.ceil((total - 1) / max(max_points - 1, 1)), 1)
+
+
+async def stream_track(request_id: int, fmt: str = "ndjson", max_points: Optional[int] = None) -> AsyncIterator[str]:
+    # Streams the stored track of a request oldest first, one line per point.
+    # Rows come from a server-side cursor, so memory use doesn't depend on
+    # the length of the track. With max_points the track is down-sampled in
+    # SQL to every n-th point, the last point is always kept. Tracks of
+    # completed requests are read from their archive row instead.
+    if fmt == "csv":
+        yield CSV_HEADER
+
+    async with async_session_maker() as session:
+        archive = await session.get(LocationTrackArchive, request_id)
+        if archive is not None:
+            points = decode_archive(archive)
+            step = sample_step(len(points), max_points)
+            for index, (lat, lng, recorded_at) in enumerate(points):
+                if index % step == 0 or index == len(points) - 1:
+                    yield format_point(lat, lng, recorded_at, fmt)
+            return
+
+        stmt = (
+            select(
+                LocationBreadcrumb.mechanic_lat,
+                LocationBreadcrumb.mechanic_lng,
+                LocationBreadcrumb.recorded_at,
+            )
+            .where(LocationBreadcrumb.request_id == request_id)
+            .order_by(LocationBreadcrumb.recorded_at)
+        )
+
+        if max_points:
+            total = await session.scalar(
+                select(func.count())
+                .select_from(LocationBreadcrumb)
+                .where(LocationBreadcrumb.request_id == request_id)
+            )
+            step = sample_step(total, max_points)
+            if step > 1:
+                numbered = select(
+                    LocationBreadcrumb.mechanic_lat,
+                    LocationBreadcrumb.mechanic_lng,
+                    LocationBreadcrumb.recorded_at,
+                    func.row_number().over(order_by=LocationBreadcrumb.recorded_at).label("rn"),
+                ).where(LocationBreadcrumb.request_id == request_id).subquery()
+                stmt = (
+                    select(numbered.c.mechanic_lat, numbered.c.mechanic_lng, numbered.c.recorded_at)
+                    .where(or_((numbered.c.rn - 1) % step == 0, numbered.c.rn == total))
+                    .order_by(numbered.c.rn)
+                )
+
+        result = await session.stream(stmt.execution_options(yield_per=REPLAY_FETCH_SIZE))
+        async for lat, lng, recorded_at in result:
+            yield format_point(lat, lng, recorded_at, fmt)
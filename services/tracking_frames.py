@@ -0,0 +1,110 @@
+import struct
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from dependencies.helper import Status
+
+
+# Subprotocols offered by tracking clients in Sec-WebSocket-Protocol.
+# JSON stays the default when the client offers neither.
+SUBPROTOCOL_JSON = "tracking.json.v1"
+SUBPROTOCOL_BINARY = "tracking.bin.v1"
+
+FRAME_VERSION = 1
+
+# Binary location frame, little-endian, 14 bytes:
+#   u8  version
+#   u8  flags
+#   i32 lat in microdegrees
+#   i32 lng in microdegrees
+#   u32 seconds since FRAME_EPOCH
+# followed by 8 bytes when FLAG_HAS_ETA is set:
+#   u32 eta in seconds
+#   u32 remaining distance in meters
+LOCATION_FRAME = struct.Struct("<BBiiI")
+ETA_EXTENSION = struct.Struct("<II")
+
+FRAME_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+# flags
+FLAG_ARRIVED = 0x01
+FLAG_HAS_STATUS = 0x02
+# bits 2-4 carry the index of the status in STATUS_CODES when FLAG_HAS_STATUS is set
+STATUS_SHIFT = 2
+STATUS_MASK = 0x07
+FLAG_HAS_ETA = 0x20
+
+STATUS_CODES = [
+    Status.pending,
+    Status.accepted,
+    Status.arrived,
+    Status.completed,
+    Status.canceled_user,
+    Status.canceled_mechanic,
+]
+
+
+def negotiate_subprotocol(offered: List[str]) -> Optional[str]:
+    if SUBPROTOCOL_BINARY in offered:
+        return SUBPROTOCOL_BINARY
+    if SUBPROTOCOL_JSON in offered:
+        return SUBPROTOCOL_JSON
+    return None
+
+
+def encode_location_frame(data: dict) -> Optional[bytes]:
+    # Frames without coordinates have no binary layout, callers send them as JSON.
+    if data.get("lat") is None or data.get("lng") is None:
+        return None
+
+    flags = 0
+    if data.get("arrived"):
+        flags |= FLAG_ARRIVED
+    if data.get("status") in STATUS_CODES:
+        flags |= FLAG_HAS_STATUS
+        flags |= STATUS_CODES.index(data["status"]) << STATUS_SHIFT
+
+    timestamp = data.get("timestamp")
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    if timestamp is None:
+        timestamp = datetime.now(timezone.utc)
+    seconds = int(timestamp.timestamp() - FRAME_EPOCH.timestamp())
+
+    has_eta = data.get("eta_seconds") is not None and data.get("remaining_km") is not None
+    if has_eta:
+        flags |= FLAG_HAS_ETA
+
+    frame = LOCATION_FRAME.pack(
+        FRAME_VERSION,
+        flags,
+        round(float(data["lat"]) * 1_000_000),
+        round(float(data["lng"]) * 1_000_000),
+        max(seconds, 0),
+    )
+    if has_eta:
+        frame += ETA_EXTENSION.pack(
+            min(max(int(data["eta_seconds"]), 0), 0xFFFFFFFF),
+            min(max(round(float(data["remaining_km"]) * 1000), 0), 0xFFFFFFFF),
+        )
+    return frame
+
+
+def decode_location_frame(frame: bytes) -> dict:
+    version, flags, lat, lng, seconds = LOCATION_FRAME.unpack_from(frame)
+    data = {
+        "version": version,
+        "lat": lat / 1_000_000,
+        "lng": lng / 1_000_000,
+        "arrived": bool(flags & FLAG_ARRIVED),
+        "timestamp": datetime.fromtimestamp(
+            FRAME_EPOCH.timestamp() + seconds, tz=timezone.utc
+        ).isoformat(),
+    }
+    if flags & FLAG_HAS_STATUS:
+        data["status"] = STATUS_CODES[(flags >> STATUS_SHIFT) & STATUS_MASK].value
+    if flags & FLAG_HAS_ETA:
+        eta_seconds, remaining_m = ETA_EXTENSION.unpack_from(frame, LOCATION_FRAME.size)
+        data["eta_seconds"] = eta_seconds
+        data["remaining_km"] = remaining_m / 1000
+    return data
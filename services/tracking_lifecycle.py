@@ -0,0 +1,56 @@
+from typing import Optional
+
+from services.eta import eta_estimator
+from services.geofence import geofences
+from services.gps_filter import gps_filter
+from services.location_cache import positions
+from services.location_writer import location_writer
+from services.tracking_sessions import tracking_sessions
+from services.webscoket_manager import CLOSE_NORMAL, manager
+
+
+async def end_tracking(
+    request_id: int,
+    event: Optional[dict] = None,
+    upstream_message: Optional[dict] = None,
+):
+    # Called once a request leaves Accepted/Arrived (arrived, canceled,
+    # completed, deleted), after the status change is committed. Sends the
+    # final event to the watchers and upstream_message to the mechanic's
+    # upstream socket, closes both and releases every per-request structure
+    # of the tracking subsystem.
+    # Buffered points must have been flushed inside the transition's
+    # transaction, whatever is left in the write buffer is discarded.
+    tracking_sessions.invalidate(request_id)
+    location_writer.discard(request_id)
+    eta_estimator.drop(request_id)
+    gps_filter.drop(request_id)
+    geofences.drop(request_id)
+    positions.drop(request_id)
+
+    if event is not None:
+        await manager.publish_event(request_id, event)
+    await manager.close_channel(
+        request_id,
+        code=CLOSE_NORMAL,
+        reason="tracking finished",
+        upstream_message=upstream_message,
+    )
+
+
+def tracking_gauges() -> dict:
+    # entries held per request by each structure, all of them go back to
+    # zero when no request is being tracked
+    return {
+        "channels": len(manager.active_connections),
+        "upstream": len(manager.upstream),
+        "pending_frames": len(manager.pending_locations),
+        "flush_tasks": len(manager.flush_tasks),
+        "rate_windows": len(manager.last_location_sent),
+        "sessions": len(tracking_sessions.sessions),
+        "positions": len(positions.positions),
+        "eta_windows": len(eta_estimator.windows),
+        "gps_filters": len(gps_filter.states),
+        "geofences": len(geofences.fences),
+        "write_buffer": len(location_writer.pending),
+    }
@@ -0,0 +1,132 @@
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import LocationTracking, ServiceRequest
+from dependencies.helper import Status
+
+load_dotenv()
+
+# cached sessions are re-read from the DB after this many seconds, which bounds
+# how long a transition handled by another worker process can go unnoticed
+SESSION_TTL = float(os.getenv("TRACKING_SESSION_TTL", "60"))
+
+
+@dataclass
+class TrackingState:
+    request_id: int
+    mechanic_id: uuid.UUID
+    dest_lat: float
+    dest_lng: float
+    track_id: int
+    # last point handed to the write-behind buffer
+    last_lat: float
+    last_lng: float
+    last_timestamp: datetime
+    # None once the session was invalidated (arrived, canceled, completed)
+    status: Optional[str] = Status.accepted
+    user_id: Optional[uuid.UUID] = None
+    loaded_at: float = field(default_factory=time.monotonic)
+
+    @classmethod
+    def from_rows(cls, request: ServiceRequest, tracking: LocationTracking) -> "TrackingState":
+        timestamp = tracking.timestamp
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        return cls(
+            request_id=request.request_id,
+            mechanic_id=request.mechanic_id,
+            dest_lat=float(request.user_lat),
+            dest_lng=float(request.user_lng),
+            track_id=tracking.track_id,
+            last_lat=float(tracking.mechanic_lat),
+            last_lng=float(tracking.mechanic_lng),
+            last_timestamp=timestamp,
+            status=request.status,
+            user_id=request.user_id,
+        )
+
+
+class TrackingSessionCache:
+    # Per-worker cache of the accepted requests being tracked, keyed by
+    # request_id. Filled on accept, dropped on arrive/cancel/complete, so a
+    # steady-state location ping needs no SELECT at all.
+
+    def __init__(self):
+        self.sessions: Dict[int, TrackingState] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, state: TrackingState):
+        self.sessions[state.request_id] = state
+
+        # sessions ended by another worker are never invalidated here, drop
+        # them once they have been stale for a while
+        cutoff = time.monotonic() - 10 * SESSION_TTL
+        for request_id in [key for key, value in self.sessions.items() if value.loaded_at < cutoff]:
+            del self.sessions[request_id]
+
+    def get(self, request_id: int) -> Optional[TrackingState]:
+        state = self.sessions.get(request_id)
+        if state is None or time.monotonic() - state.loaded_at >= SESSION_TTL:
+            return None
+        return state
+
+    async def get_or_load(self, request_id: int, session: AsyncSession) -> Optional[TrackingState]:
+        # None if the request or its tracking row doesn't exist. Only Accepted
+        # requests are cached, callers check the returned status.
+        state = self.get(request_id)
+        if state is not None:
+            self.hits += 1
+            return state
+
+        self.misses += 1
+        result = await session.execute(
+            select(ServiceRequest, LocationTracking)
+            .join(LocationTracking, LocationTracking.request_id == ServiceRequest.request_id)
+            .where(ServiceRequest.request_id == request_id)
+            .order_by(LocationTracking.timestamp.desc())
+            .limit(1)
+        )
+        row = result.first()
+        if row is None:
+            return None
+
+        request, tracking = row
+        state = TrackingState.from_rows(request, tracking)
+        previous = self.sessions.get(request_id)
+        if state.status != Status.accepted:
+            self.invalidate(request_id)
+            return state
+
+        if previous is not None:
+            # revalidated after the TTL: keep the object upstream sockets hold
+            # and its in-memory point, which is newer than the stored one
+            previous.loaded_at = state.loaded_at
+            return previous
+
+        self.put(state)
+        return state
+
+    def invalidate(self, request_id: int):
+        state = self.sessions.pop(request_id, None)
+        if state is not None:
+            # ends any upstream socket still streaming for this request
+            state.status = None
+
+    def stats(self) -> dict:
+        return {
+            "active": len(self.sessions),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+tracking_sessions = TrackingSessionCache()
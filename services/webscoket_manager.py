@@ -1,18 +1,85 @@
 # websocket_manager.py
 
-from typing import Dict, List
-from fastapi import WebSocket
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, Optional
+from fastapi import WebSocket, WebSocketDisconnect
+from dotenv import load_dotenv
+
+from services.tracking_frames import SUBPROTOCOL_BINARY, encode_location_frame
+
+load_dotenv()
+
+# per-process limits, sockets above the cap evict the stalest connection
+MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "5000"))
+MAX_CONNECTIONS_PER_REQUEST = int(os.getenv("WS_MAX_CONNECTIONS_PER_REQUEST", "5"))
+
+# a ping is sent after HEARTBEAT_INTERVAL seconds of silence; tracking
+# sockets stay open as long as they take the pings, the other sockets
+# are closed after IDLE_TIMEOUT seconds without a client frame
+HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "20"))
+IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "60"))
+SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "5"))
+
+# location frames are coalesced per request, only the newest one is sent
+# and at most BROADCAST_MAX_HZ times per second (0 disables the limit)
+BROADCAST_MAX_HZ = float(os.getenv("TRACKING_BROADCAST_MAX_HZ", "1"))
+
+CLOSE_NORMAL = 1000
+CLOSE_GOING_AWAY = 1001
+CLOSE_TRY_AGAIN_LATER = 1013
+
 
 class ConnectionManager:
     def __init__(self):
         # request_id -> list of active websocket connections
         self.active_connections: Dict[int, List[WebSocket]] = {}
+        # websocket -> request_id it is attached to
+        self.channels: Dict[WebSocket, int] = {}
+        # websocket -> monotonic time of the last frame received from the client
+        self.last_seen: Dict[WebSocket, float] = {}
+        # sockets that negotiated the binary frame subprotocol
+        self.binary_sockets: set = set()
+        # request_id -> mechanic upstream socket streaming its fixes
+        self.upstream: Dict[int, WebSocket] = {}
+
+        # request_id -> newest location frame not sent yet
+        self.pending_locations: Dict[int, dict] = {}
+        # request_id -> monotonic time the last location frame was sent
+        self.last_location_sent: Dict[int, float] = {}
+        # request_id -> scheduled flush of the pending location frame
+        self.flush_tasks: Dict[int, asyncio.Task] = {}
+
+        self.opened_count = 0
+        self.closed_count = 0
+        self.evicted_count = 0
+
+    async def connect(
+        self,
+        request_id: int,
+        websocket: WebSocket,
+        subprotocol: Optional[str] = None,
+    ):
+        await websocket.accept(subprotocol=subprotocol)
+
+        channel = self.active_connections.get(request_id, [])
+        if len(channel) >= MAX_CONNECTIONS_PER_REQUEST:
+            await self.evict(request_id, channel[0])
+
+        if len(self.channels) >= MAX_CONNECTIONS:
+            stalest = min(self.last_seen, key=self.last_seen.get)
+            await self.evict(self.channels[stalest], stalest)
 
-    async def connect(self, request_id: int, websocket: WebSocket):
-        await websocket.accept()
         if request_id not in self.active_connections:
             self.active_connections[request_id] = []
         self.active_connections[request_id].append(websocket)
+        self.channels[websocket] = request_id
+        self.last_seen[websocket] = time.monotonic()
+        if subprotocol == SUBPROTOCOL_BINARY:
+            self.binary_sockets.add(websocket)
+        self.opened_count += 1
 
     def disconnect(self, request_id: int, websocket: WebSocket):
         if request_id in self.active_connections:
@@ -20,19 +87,226 @@ class ConnectionManager:
                 self.active_connections[request_id].remove(websocket)
             if not self.active_connections[request_id]:
                 del self.active_connections[request_id]
+                self.drop_pending(request_id)
+                self.last_location_sent.pop(request_id, None)
+
+        if self.channels.pop(websocket, None) is not None:
+            self.last_seen.pop(websocket, None)
+            self.binary_sockets.discard(websocket)
+            self.closed_count += 1
+
+    async def evict(
+        self,
+        request_id: int,
+        websocket: WebSocket,
+        code: int = CLOSE_TRY_AGAIN_LATER,
+        reason: str = "connection limit reached",
+    ):
+        if websocket not in self.channels:
+            return
+        self.disconnect(request_id, websocket)
+        self.evicted_count += 1
+        try:
+            await websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    async def close_channel(
+        self,
+        request_id: int,
+        code: int = CLOSE_NORMAL,
+        reason: str = "",
+        upstream_message: Optional[dict] = None,
+    ):
+        # Closes every socket of the request, watchers and upstream, and
+        # forgets the channel with its coalescer state. The upstream socket
+        # gets upstream_message first, if any.
+        sockets = list(self.active_connections.get(request_id, []))
+        for websocket in sockets:
+            self.disconnect(request_id, websocket)
+        self.drop_pending(request_id)
+        self.last_location_sent.pop(request_id, None)
+
+        upstream = self.upstream.pop(request_id, None)
+        if upstream is not None:
+            if upstream_message is not None:
+                try:
+                    await asyncio.wait_for(upstream.send_json(upstream_message), timeout=SEND_TIMEOUT)
+                except Exception:
+                    pass
+            sockets.append(upstream)
+
+        for websocket in sockets:
+            try:
+                await websocket.close(code=code, reason=reason)
+            except Exception:
+                pass
+
+    async def attach_upstream(self, request_id: int, websocket: WebSocket):
+        # one upstream per request, a reconnecting mechanic replaces the old one
+        previous = self.upstream.get(request_id)
+        self.upstream[request_id] = websocket
+        if previous is not None and previous is not websocket:
+            try:
+                await previous.close(code=CLOSE_GOING_AWAY, reason="replaced")
+            except Exception:
+                pass
+
+    def detach_upstream(self, request_id: int, websocket: WebSocket):
+        if self.upstream.get(request_id) is websocket:
+            del self.upstream[request_id]
+
+    async def listen(self, request_id: int, websocket: WebSocket):
+        # Receive loop for a connected socket. Any frame from the client counts
+        # as activity, a {"type": "ping"} frame is answered with a pong.
+        try:
+            while websocket in self.channels:
+                try:
+                    message = await asyncio.wait_for(
+                        websocket.receive(), timeout=HEARTBEAT_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    # Clients aren't required to send anything: a ping the
+                    # client takes within SEND_TIMEOUT counts as activity,
+                    # only a socket that can't take it any more is closed.
+                    try:
+                        await asyncio.wait_for(
+                            websocket.send_json({"type": "ping"}), timeout=SEND_TIMEOUT
+                        )
+                    except Exception:
+                        await self.evict(
+                            request_id,
+                            websocket,
+                            code=CLOSE_GOING_AWAY,
+                            reason="unresponsive",
+                        )
+                        return
+                    self.last_seen[websocket] = time.monotonic()
+                    continue
+
+                if message["type"] == "websocket.disconnect":
+                    break
+
+                self.last_seen[websocket] = time.monotonic()
+
+                if _is_ping(message):
+                    await asyncio.wait_for(
+                        websocket.send_json({"type": "pong"}), timeout=SEND_TIMEOUT
+                    )
+        except (WebSocketDisconnect, RuntimeError, asyncio.TimeoutError):
+            pass
+        finally:
+            self.disconnect(request_id, websocket)
 
     async def broadcast(self, request_id: int, data: dict):
         if request_id in self.active_connections:
             dead_connections = []
+            # each encoding is built once per broadcast, not once per socket
+            text = None
+            frame = None
 
-            for connection in self.active_connections[request_id]:
+            for connection in list(self.active_connections[request_id]):
+                if connection in self.binary_sockets and frame is None:
+                    frame = encode_location_frame(data) or b""
                 try:
-                    await connection.send_json(data)
+                    if connection in self.binary_sockets and frame:
+                        await asyncio.wait_for(
+                            connection.send_bytes(frame), timeout=SEND_TIMEOUT
+                        )
+                    else:
+                        if text is None:
+                            text = json.dumps(data, default=str)
+                        await asyncio.wait_for(
+                            connection.send_text(text), timeout=SEND_TIMEOUT
+                        )
                 except Exception:
                     dead_connections.append(connection)
 
             for connection in dead_connections:
-                self.disconnect(request_id, connection)
+                await self.evict(request_id, connection, reason="send failed")
+
+    async def send_to(self, websocket: WebSocket, data: dict):
+        frame = None
+        if websocket in self.binary_sockets:
+            frame = encode_location_frame(data)
+        try:
+            if frame:
+                await asyncio.wait_for(websocket.send_bytes(frame), timeout=SEND_TIMEOUT)
+            else:
+                await asyncio.wait_for(
+                    websocket.send_text(json.dumps(data, default=str)),
+                    timeout=SEND_TIMEOUT,
+                )
+        except Exception:
+            await self.evict(self.channels.get(websocket), websocket, reason="send failed")
+
+    async def publish_location(self, request_id: int, data: dict):
+        # Latest-wins: a frame arriving inside the rate window replaces the
+        # pending one and goes out when the window closes.
+        if request_id not in self.active_connections:
+            return
+
+        self.pending_locations[request_id] = data
+        if request_id in self.flush_tasks:
+            return
+
+        wait = 0.0
+        if BROADCAST_MAX_HZ > 0:
+            last_sent = self.last_location_sent.get(request_id)
+            if last_sent is not None:
+                wait = last_sent + 1 / BROADCAST_MAX_HZ - time.monotonic()
+
+        if wait <= 0:
+            await self._send_pending(request_id)
+        else:
+            self.flush_tasks[request_id] = asyncio.create_task(
+                self._flush_later(request_id, wait)
+            )
+
+    async def publish_event(self, request_id: int, data: dict):
+        # arrival and status events skip the rate limit and supersede any
+        # location frame still waiting to be sent
+        self.drop_pending(request_id)
+        await self.broadcast(request_id, data)
+
+    def drop_pending(self, request_id: int):
+        self.pending_locations.pop(request_id, None)
+        task = self.flush_tasks.pop(request_id, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+
+    async def _flush_later(self, request_id: int, wait: float):
+        await asyncio.sleep(wait)
+        self.flush_tasks.pop(request_id, None)
+        await self._send_pending(request_id)
+
+    async def _send_pending(self, request_id: int):
+        data = self.pending_locations.pop(request_id, None)
+        if data is None:
+            return
+        self.last_location_sent[request_id] = time.monotonic()
+        await self.broadcast(request_id, data)
+
+    def stats(self) -> dict:
+        return {
+            "open": len(self.channels),
+            "binary": len(self.binary_sockets),
+            "channels": len(self.active_connections),
+            "upstream": len(self.upstream),
+            "opened": self.opened_count,
+            "closed": self.closed_count,
+            "evicted": self.evicted_count,
+        }
+
+
+def _is_ping(message: dict) -> bool:
+    text = message.get("text")
+    if not text:
+        return False
+    try:
+        return json.loads(text).get("type") == "ping"
+    except (ValueError, AttributeError):
+        return False
 
 
 manager = ConnectionManager()